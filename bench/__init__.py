@@ -0,0 +1,6 @@
+"""
+调度器基准测试：用 coper.basic_ops 构造典型 DAG，测量提交吞吐、端到端延迟与单节点开销。
+
+    python -m bench.run --backend inproc
+    python -m bench.run --backend local --router bench   # 需另行启动 python -m core.Runner --router bench
+"""
@@ -0,0 +1,65 @@
+"""
+基准图形状。每个构造函数在当前 Context 中提交一张 DAG，返回需要等待的汇点结果列表；
+节点总数由 runner-node-counter 统计，构造函数本身不需要计数。
+"""
+import random
+
+from core.Computable import Computable
+from coper.basic_ops import Add, Negate, Sum
+
+
+def chain(n):
+    """长链：n 个节点串行，每个节点依赖前一个。"""
+    x = Add()(0, 1)
+    for _ in range(n - 1):
+        x = Add()(x, 1)
+    return [x]
+
+
+def fan_out(n):
+    """宽扇出：一个源节点完成后同时释放 n 个子节点。"""
+    src = Add()(0, 1)
+    return list(Negate().map([src] * n))
+
+
+def fan_in(n):
+    """深扇入：n 个叶子经二叉归约树汇聚到一个根节点。"""
+    leaves = Negate().map(range(n))
+    return [Computable.reduce(leaves, Sum(), arity=2)]
+
+
+def diamond(n):
+    """n 个首尾相连的菱形：top -> (left, right) -> bottom，每个菱形的值保持为 1。"""
+    top = Add()(0, 1)
+    for _ in range(n):
+        left = Add()(top, 1)
+        right = Negate()(top)
+        top = Add()(left, right)
+    return [top]
+
+
+def random_dag(n, seed=0, max_deps=3, source_ratio=0.1):
+    """
+    随机 DAG：每个节点以 source_ratio 的概率作为源节点，否则从已提交的节点中随机选取
+    1 ~ max_deps 个作为依赖。源节点的值为 0，避免求和结果随深度指数增长。
+    """
+    rng = random.Random(seed)
+    nodes = []
+    used = set()
+    for i in range(n):
+        if i == 0 or rng.random() < source_ratio:
+            nodes.append(Negate()(0))
+            continue
+        picks = rng.sample(range(len(nodes)), rng.randint(1, min(max_deps, len(nodes))))
+        used.update(picks)
+        nodes.append(Sum()(*(nodes[p] for p in picks)))
+    return [r for i, r in enumerate(nodes) if i not in used]
+
+
+SHAPES = {
+    "chain": chain,
+    "fan_out": fan_out,
+    "fan_in": fan_in,
+    "diamond": diamond,
+    "random_dag": random_dag,
+}
@@ -0,0 +1,76 @@
+"""
+冷启动 import 耗时基准：每个模块在独立的解释器中导入，记录耗时以及被连带导入的重量级 SDK。
+
+    python -m bench.imports
+    python -m bench.imports --check --budget-ms 500   # core 模块超出预算或导入了重量级 SDK 时返回非零
+
+core 模块与算子模块在导入时都不应加载 litellm / pymilvus / minio，
+这些 SDK 只在真正调用对应后端时导入。
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from bench.run import percentile, versions
+
+CORE_MODULES = ["core.Context", "core.Computable", "core.ComputableResult", "core.Runner", "core.Service"]
+OPERATOR_MODULES = ["coper.basic_ops", "coper.LLM", "coper.Embedding", "coper.VectorDB", "coper.Minio",
+                    "coper.TTS", "coper.Service"]
+HEAVY_SDKS = ["litellm", "pymilvus", "minio"]
+
+SNIPPET = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - t0) * 1000
+print(json.dumps({{"ms": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, repeat):
+    samples = []
+    heavy = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(module=module, heavy=HEAVY_SDKS)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        rv = json.loads(out.strip().splitlines()[-1])
+        samples.append(rv["ms"])
+        heavy = rv["heavy"]
+    return {"p50_ms": percentile(samples, 50), "max_ms": max(samples), "heavy_sdks": heavy}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold import-time benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreter runs per module")
+    parser.add_argument("--modules", help="Comma separated module list (default: core and coper modules)")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if a core module is too slow or heavy")
+    parser.add_argument("--budget-ms", type=float, default=500.0, help="Import budget per core module for --check")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    modules = args.modules.split(",") if args.modules else CORE_MODULES + OPERATOR_MODULES
+    results = {m: measure(m, args.repeat) for m in modules}
+    report = {"versions": versions(), "modules": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.check:
+        failures = [
+            f"{m}: {r['p50_ms']:.0f}ms, heavy SDKs {r['heavy_sdks']}"
+            for m, r in results.items()
+            if r["heavy_sdks"] or (m.startswith("core.") and r["p50_ms"] > args.budget_ms)
+        ]
+        if failures:
+            print("import-time check failed:\n  " + "\n  ".join(failures), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+运行基准并输出 JSON。
+
+    python -m bench.run --backend inproc --shapes chain,fan_out --size 200 --repeat 5 --output result.json
+
+backend:
+    inproc  进程内替身（fakeredis + 内存队列 + Runner 线程），见 bench.standin
+    local   middleware/.env 中配置的 Redis / RabbitMQ，需要先启动 ``python -m core.Runner --router <router>``
+
+每个形状重复 repeat 次（另有 warmup 次预热不计入），输出：
+    submit_nodes_per_sec  提交阶段吞吐（节点数 / 构图耗时）
+    latency_ms            从开始提交到全部汇点完成的端到端延迟分位数
+    node_overhead_ms      单节点调度开销均值（排队 + 依赖读取 + 结果写入，来自 core.trace）
+    e2e_per_node_ms       端到端延迟 / 节点数
+另外记录 git 版本以及 Runner.py 与各 Lua 脚本的哈希，便于跨版本对比。
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+
+from bench.graphs import SHAPES
+from core import trace
+from core.ComputableResult import gather
+
+VERSIONED_FILES = ["Runner.py", "Computable.py", "init_task.lua", "claim_task.lua", "finish_task.lua", "node_lib.lua"]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    idx = min(len(samples) - 1, int(len(samples) * q / 100))
+    return samples[idx]
+
+
+def versions():
+    core_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core")
+    rv = {}
+    try:
+        rv["git"] = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=core_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rv["git"] = None
+    for name in VERSIONED_FILES:
+        with open(os.path.join(core_dir, name), "rb") as f:
+            rv[name] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return rv
+
+
+def cleanup(redis, task_id):
+    keys = [f"runner-node:{task_id}", f"runner-node-counter:{task_id}", trace.trace_key(task_id)]
+    for pattern in (f"runner-node-waiters:{task_id}:*", f"runner-node-result:{task_id}:*"):
+        keys.extend(redis.scan_iter(match=pattern, count=1000))
+    for i in range(0, len(keys), 500):
+        redis.delete(*keys[i:i + 500])
+
+
+def run_once(ctx, shape, size, timeout):
+    task_id = f"bench-{shape}-{uuid.uuid4().hex}"
+    ctx.set_task(task_id)
+    start = time.perf_counter()
+    sinks = SHAPES[shape](size)
+    submitted = time.perf_counter()
+    gather(sinks, timeout=timeout)
+    done = time.perf_counter()
+
+    nodes = int(ctx.redis.get(f"runner-node-counter:{task_id}") or 0)
+    overheads = []
+    if ctx.trace:
+        for n in trace.load(ctx.redis, task_id).values():
+            p = trace.phases(n)
+            parts = [p["queue"], p["resolve"], p["store"]]
+            if None not in parts:
+                overheads.append(sum(parts))
+    cleanup(ctx.redis, task_id)
+    return {
+        "nodes": nodes,
+        "submit_s": submitted - start,
+        "e2e_s": done - start,
+        "overhead_ms": sum(overheads) / len(overheads) if overheads else None,
+    }
+
+
+def summarize(runs):
+    nodes = runs[0]["nodes"]
+    latency = [r["e2e_s"] * 1000 for r in runs]
+    throughput = [r["nodes"] / r["submit_s"] for r in runs if r["submit_s"] > 0]
+    overhead = [r["overhead_ms"] for r in runs if r["overhead_ms"] is not None]
+    return {
+        "nodes": nodes,
+        "runs": len(runs),
+        "submit_nodes_per_sec": percentile(throughput, 50) if throughput else None,
+        "latency_ms": {
+            "p50": percentile(latency, 50),
+            "p90": percentile(latency, 90),
+            "p99": percentile(latency, 99),
+            "mean": sum(latency) / len(latency),
+            "max": max(latency),
+        },
+        "node_overhead_ms": sum(overhead) / len(overhead) if overhead else None,
+        "e2e_per_node_ms": percentile(latency, 50) / nodes if nodes else None,
+    }
+
+
+def bench(ctx, shapes, size, repeat, warmup, timeout):
+    results = {}
+    for shape in shapes:
+        for _ in range(warmup):
+            run_once(ctx, shape, size, timeout)
+        runs = [run_once(ctx, shape, size, timeout) for _ in range(repeat)]
+        results[shape] = summarize(runs)
+        print(f"{shape:<12} nodes={results[shape]['nodes']:<6} "
+              f"p50={results[shape]['latency_ms']['p50']:.1f}ms", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scheduler benchmark on synthetic DAGs")
+    parser.add_argument("--backend", choices=["inproc", "local"], default="inproc")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="Comma separated subset of " + ", ".join(SHAPES))
+    parser.add_argument("--size", type=int, default=200, help="Shape size parameter (roughly the node count)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8, help="Runner threads for the inproc backend")
+    parser.add_argument("--router", default="bench", help="Runner router for the local backend")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-run timeout in seconds")
+    parser.add_argument("--no-trace", action="store_true", help="Disable the trace ledger (no per-node overhead)")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    shapes = [s for s in args.shapes.split(",") if s]
+    unknown = [s for s in shapes if s not in SHAPES]
+    if unknown:
+        parser.error(f"unknown shapes: {', '.join(unknown)}")
+
+    with contextlib.ExitStack() as stack:
+        if args.backend == "inproc":
+            from bench.standin import InProcessCluster
+            cluster = stack.enter_context(InProcessCluster(workers=args.workers, trace=not args.no_trace))
+            ctx = stack.enter_context(cluster.context())
+        else:
+            from core.Context import Context
+            ctx = stack.enter_context(Context(router=args.router, trace=not args.no_trace))
+        results = bench(ctx, shapes, args.size, args.repeat, args.warmup, args.timeout)
+
+    report = {
+        "backend": args.backend,
+        "size": args.size,
+        "workers": args.workers if args.backend == "inproc" else None,
+        "trace": not args.no_trace,
+        "python": platform.python_version(),
+        "versions": versions(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "shapes": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
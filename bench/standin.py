@@ -0,0 +1,93 @@
+"""
+进程内的 Redis / RabbitMQ 替身：fakeredis（需要 lupa 以执行 Lua 脚本）+ 内存队列，
+Runner 以线程方式消费。用于在没有中间件的机器上比较调度器本身的开销。
+
+依赖：pip install "fakeredis[lua]"
+"""
+import contextvars
+import queue
+import threading
+
+from core import trace
+from core.Context import Context, _current_ctx
+
+
+class InProcessContext(Context):
+    """
+    与 Context 接口一致，但不读取 middleware/.env，也不连接任何外部服务。
+    同一个 server / mq 上的多个实例共享数据与队列。
+    """
+
+    def __init__(self, server, mq, task_id=None, trace=True, max_in_flight=0, backpressure="block"):
+        import fakeredis
+
+        self.router = ""
+        self.queue = "runner_task_queue"
+        self._task_var = contextvars.ContextVar("task_id", default=task_id)
+        self.trace = trace
+        self.max_in_flight = max_in_flight
+        self.backpressure = backpressure
+        self.backpressure_timeout = 300
+        self._token = None
+        self._minio = None
+        self._connection = None
+        # Runner 只在 start() 中使用 channel，这里放一个占位对象
+        self._channel = object()
+        self._mq = mq
+        self._scripts = {}
+        self._redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+
+    def send_mq_messages_now(self, messages, queue=None):
+        for message in messages:
+            self._mq.put((message, trace.now_ms()))
+
+    def send_mq_message(self, message, queue=None, on_rejected=None):
+        self._mq.put((message, trace.now_ms()))
+
+    def ack_mq_message(self, delivery_tag):
+        pass
+
+    def __enter__(self):
+        self._token = _current_ctx.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_ctx.reset(self._token)
+
+
+class InProcessCluster:
+    """一个 fakeredis server、一个内存队列以及 workers 个 Runner 线程。"""
+
+    def __init__(self, workers=8, trace=True):
+        import fakeredis
+
+        self.server = fakeredis.FakeServer()
+        self.mq = queue.Queue()
+        self.trace = trace
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+    def context(self, task_id=None):
+        return InProcessContext(self.server, self.mq, task_id=task_id, trace=self.trace)
+
+    def _work(self):
+        from core.Runner import Runner
+
+        with self.context():
+            runner = Runner()
+            while True:
+                item = self.mq.get()
+                if item is None:
+                    return
+                body, ready_at = item
+                runner.process_message(body, 0, ready_at)
+
+    def __enter__(self):
+        for t in self._threads:
+            t.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for _ in self._threads:
+            self.mq.put(None)
+        for t in self._threads:
+            t.join()
@@ -0,0 +1,107 @@
+"""
+Context 启动耗时基准。
+
+    python -m bench.startup --iterations 200
+    python -m bench.startup --connect        # 额外测量各后端首次连接耗时（需要 middleware/.env 中的服务可用）
+
+输出（JSON，单位毫秒）：
+    cold_ms        新进程中 import core.Context 并完成第一次 Context 进入 / 退出的耗时
+    context_ms     同一进程内 Context() 构造 + __enter__ + __exit__ 的分位数
+    first_use_ms   (--connect) Redis / RabbitMQ / MinIO / Milvus 各自首次使用的耗时
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from bench.run import percentile, versions
+
+COLD_SNIPPET = """
+import time
+t0 = time.perf_counter()
+from core.Context import Context
+with Context():
+    pass
+print((time.perf_counter() - t0) * 1000)
+"""
+
+
+def cold_start(repeat):
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_SNIPPET], capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return samples
+
+
+def warm_start(iterations):
+    from core.Context import Context
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        with Context():
+            pass
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def first_use():
+    from core.Context import Context
+
+    rv = {}
+    with Context() as ctx:
+        for name, use in (
+            ("redis", lambda: ctx.redis.ping()),
+            ("rabbitmq", lambda: ctx.channel),
+            ("minio", lambda: ctx.minio.list_buckets()),
+            ("milvus", lambda: ctx.milvus),
+        ):
+            start = time.perf_counter()
+            try:
+                use()
+            except Exception as e:
+                rv[name] = {"error": str(e)}
+            else:
+                rv[name] = (time.perf_counter() - start) * 1000
+    return rv
+
+
+def stats(samples):
+    return {
+        "p50": percentile(samples, 50),
+        "p90": percentile(samples, 90),
+        "p99": percentile(samples, 99),
+        "mean": sum(samples) / len(samples),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Context startup benchmark")
+    parser.add_argument("--iterations", type=int, default=200, help="Warm Context enter/exit iterations")
+    parser.add_argument("--cold", type=int, default=5, help="Fresh interpreter runs")
+    parser.add_argument("--connect", action="store_true", help="Also time the first use of each backend")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        "versions": versions(),
+        "cold_ms": stats(cold_start(args.cold)),
+        "context_ms": stats(warm_start(args.iterations)),
+    }
+    if args.connect:
+        report["first_use_ms"] = first_use()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
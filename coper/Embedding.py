@@ -1,12 +1,18 @@
 import os
 import requests
 from core.Computable import Computable
+from core.RateLimiter import RateLimiter, estimate_tokens
 from typing import Union, List
 from dotenv import load_dotenv
 
 
 class Embedding(Computable):
-    """Generate embeddings for text."""
+    """Generate embeddings for text.
+
+    调用前从共享令牌桶获取配额，限额由 EMBEDDING_RPM / EMBEDDING_TPM 环境变量配置（见 core.RateLimiter）。
+    """
+
+    idempotent = True
 
     def __init__(self):
         super().__init__()
@@ -17,6 +23,7 @@ class Embedding(Computable):
         self.url = os.getenv('EMBEDDING_URL')
         self.api_key = os.getenv('EMBEDDING_API_KEY')
         self.model = os.getenv('EMBEDDING_MODEL')
+        self.limiter = RateLimiter("EMBEDDING", self.model or "")
     
     def compute(self, text: Union[str, List[str]], **kwargs) -> Union[List[float], List[List[float]], None]:
         """Return embedding vectors for the given text.
@@ -42,11 +49,18 @@ class Embedding(Computable):
             "input": input_texts
         }
         
+        reserved = self.limiter.acquire(estimate_tokens(*input_texts))
         try:
-            response = requests.post(self.url, headers=headers, json=data)
-            response.raise_for_status()  # 抛出HTTP错误异常
+            try:
+                response = requests.post(self.url, headers=headers, json=data)
+                response.raise_for_status()  # 抛出HTTP错误异常
+            except Exception:
+                # 请求失败，退回预占的 token
+                self.limiter.settle(reserved, 0)
+                raise
             
             result = response.json()
+            self.limiter.settle(reserved, (result.get('usage') or {}).get('total_tokens'))
             
             # 提取嵌入向量
             if 'data' in result and len(result['data']) > 0:
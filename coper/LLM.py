@@ -1,10 +1,93 @@
 from core.Computable import Computable
+from core.RateLimiter import estimate_tokens
+from coper import LLMUsage
+from coper.LLMRouter import TIMEOUT, Endpoint, LLMRouter, is_retryable
 from dotenv import load_dotenv
+import asyncio
+import contextvars
+import functools
+import json
 import os
-import litellm
-from typing import Optional, Union, Type
+import re
+import threading
+import time
+import weakref
+from typing import Literal, Optional, Union, Type
 from pydantic import BaseModel, Field, create_model
 
+# 自定义 Provider（OpenAI 兼容接口）的 HTTP 连接池配置，同一 base_url / api_key 的调用共享连接池，
+# 避免每次调用都重新建立 TCP / TLS 连接
+POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "256"))
+POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "256"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+
+# MinIO 图片引用的解析方式：inline 在 Worker 中读取对象并转为 data URL；url 生成预签名 URL 交给模型端点下载
+IMAGE_MODE = os.getenv("LLM_IMAGE_MODE", "inline")
+IMAGE_URL_EXPIRY = int(os.getenv("LLM_IMAGE_URL_EXPIRY", "3600"))
+
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+# 当前调用的 [开始时间, 首字节时间]，由连接池客户端的 response 钩子在收到响应头时填写
+_call_timing = contextvars.ContextVar("llm_call_timing", default=None)
+
+
+def _mark_first_byte(response):
+    timing = _call_timing.get()
+    if timing is not None and timing[1] is None:
+        timing[1] = time.monotonic()
+
+
+async def _amark_first_byte(response):
+    _mark_first_byte(response)
+
+
+def _pool_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _sync_client(base_url, api_key, max_retries=None):
+    """
+    同步调用共享的 OpenAI 客户端（httpx.Client 线程安全，Runner 的工作线程共用一个连接池）。
+    max_retries 不为 None 时返回共享同一连接池、但重试次数不同的副本（路由模式下由路由器负责切换端点）。
+    """
+    if max_retries is not None:
+        return _sync_client(base_url, api_key).with_options(max_retries=max_retries)
+    import openai
+    return openai.OpenAI(api_key=api_key, base_url=base_url,
+                         http_client=openai.DefaultHttpxClient(
+                             limits=_pool_limits(), event_hooks={"response": [_mark_first_byte]}))
+
+
+def _async_client(base_url, api_key, max_retries=None):
+    """异步调用共享的 OpenAI 客户端。httpx.AsyncClient 绑定事件循环，因此按事件循环分别缓存。"""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get((base_url, api_key, max_retries))
+        if client is None:
+            if max_retries is not None:
+                base = clients.get((base_url, api_key, None))
+            else:
+                base = None
+            if base is None:
+                import openai
+                base = clients[(base_url, api_key, None)] = openai.AsyncOpenAI(
+                    api_key=api_key, base_url=base_url,
+                    http_client=openai.DefaultAsyncHttpxClient(
+                        limits=_pool_limits(), event_hooks={"response": [_amark_first_byte]}),
+                )
+            client = base if max_retries is None else base.with_options(max_retries=max_retries)
+            clients[(base_url, api_key, max_retries)] = client
+    return client
+
+
 # 定义JSON Schema类型到Python类型的映射
 type_mapping = {
     'string': str,
@@ -12,26 +95,125 @@ type_mapping = {
     'number': float,
     'boolean': bool,
     'object': dict,
-    'array': list
+    'array': list,
+    'null': type(None),
 }
 
 
-def restore_model_from_schema(schema: dict) -> type[BaseModel]:
+class _SchemaCompiler:
+    """
+    把 JSON Schema 编译为 Pydantic 模型，支持嵌套 object、数组 items、$defs / definitions 引用（包括递归引用）、
+    enum / const、anyOf / oneOf 以及 ["string", "null"] 形式的可空类型。
+    """
+
+    def __init__(self, schema: dict):
+        self.root = schema
+        self.defs = {**schema.get("definitions", {}), **schema.get("$defs", {})}
+        self.models = {}      # $defs 名称 -> 已编译的模型
+        self.building = set()  # 正在编译的 $defs 名称，用于识别递归引用
+        self.recursive = False
+
+    def compile(self) -> type[BaseModel]:
+        if "$ref" in self.root and "properties" not in self.root:
+            # 递归模型的 schema 形如 {"$defs": {...}, "$ref": "#/$defs/Node"}
+            model = self._ref(self.root["$ref"])
+        else:
+            model = self._model(self.root, self.root.get("title", "DynamicModel"))
+        if self.recursive:
+            namespace = {name: m for name, m in self.models.items()}
+            for m in [*self.models.values(), model]:
+                m.model_rebuild(_types_namespace=namespace)
+        return model
+
+    def _ref(self, ref: str):
+        name = ref.rsplit("/", 1)[-1]
+        if name in self.models:
+            return self.models[name]
+        if name in self.building:
+            # 递归引用：先用名称占位，编译完成后统一 model_rebuild
+            self.recursive = True
+            return name
+        if name not in self.defs:
+            raise ValueError(f"Unresolvable schema reference {ref}")
+        self.building.add(name)
+        self.models[name] = self._type(self.defs[name], name)
+        self.building.discard(name)
+        return self.models[name]
+
+    def _type(self, prop: dict, name: str):
+        if "$ref" in prop:
+            return self._ref(prop["$ref"])
+        if "const" in prop:
+            return Literal[prop["const"]]
+        if "enum" in prop:
+            return Literal[tuple(prop["enum"])]
+        for key in ("anyOf", "oneOf"):
+            if key in prop:
+                options = tuple(self._type(p, f"{name}Option{i}") for i, p in enumerate(prop[key]))
+                return Union[options] if len(options) > 1 else options[0]
+        if "allOf" in prop and len(prop["allOf"]) == 1:
+            return self._type(prop["allOf"][0], name)
+
+        ptype = prop.get("type")
+        if isinstance(ptype, list):
+            options = tuple(self._type({**prop, "type": t}, name) for t in ptype)
+            return Union[options] if len(options) > 1 else options[0]
+        if ptype == "array":
+            items = prop.get("items")
+            return list[self._type(items, f"{name}Item")] if items else list
+        if ptype == "object" or (ptype is None and "properties" in prop):
+            if "properties" in prop:
+                return self._model(prop, prop.get("title", name))
+            extra = prop.get("additionalProperties")
+            if isinstance(extra, dict):
+                return dict[str, self._type(extra, f"{name}Value")]
+            return dict
+        return type_mapping.get(ptype, str)  # 默认str
+
+    def _model(self, schema: dict, model_name: str) -> type[BaseModel]:
+        required = set(schema.get("required", []))
+        fields = {}
+        for name, prop in schema.get("properties", {}).items():
+            ptype = self._type(prop, f"{model_name}{name.title().replace('_', '')}")
+            description = prop.get("description", "")
+            if name in required:
+                default = ...  # 必填用 Ellipsis
+            else:
+                default = prop.get("default")
+                ptype = Optional[ptype]
+            fields[name] = (ptype, Field(default, description=description))
+        return create_model(model_name, **fields)
+
+
+class _SchemaKey:
     """
-    根据JSON Schema恢复Pydantic模型
+    编译缓存的键：按 schema 的 JSON 文本比较与哈希，同时携带原始 schema 供编译使用。
+    JSON 文本保留键的顺序——属性顺序决定结构化解码时字段的生成顺序（如先 reasoning 后 answer），
+    属性顺序不同的 schema 必须编译为不同的模型。
     """
-    props = schema.get("properties", {})
-    required = set(schema.get("required", []))
-    fields = {}
 
-    for name, prop in props.items():
-        ptype = type_mapping.get(prop.get("type"), str)  # 默认str
-        description = prop.get("description", "")
-        default = ... if name in required else None  # 必填用 Ellipsis
-        fields[name] = (ptype, Field(default, description=description))
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.text = json.dumps(schema, ensure_ascii=False)
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __eq__(self, other):
+        return isinstance(other, _SchemaKey) and self.text == other.text
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_schema(key: _SchemaKey) -> type[BaseModel]:
+    return _SchemaCompiler(key.schema).compile()
 
-    model_name = schema.get("title", "DynamicModel")
-    return create_model(model_name, **fields)
+
+def restore_model_from_schema(schema: dict) -> type[BaseModel]:
+    """
+    根据JSON Schema恢复Pydantic模型，字段顺序与 schema 中 properties 的顺序一致。
+    编译结果按 schema 的 JSON 文本在进程内缓存，相同 schema 只编译一次。
+    """
+    return _compile_schema(_SchemaKey(schema))
 
 
 class LLMInput(BaseModel):
@@ -45,9 +227,10 @@ class LLMInput(BaseModel):
         ..., 
         description="The text prompt to send to the LLM model. This is the main instruction or query."
     )
-    image_base64: Optional[str] = Field(
+    image_base64: Optional[Union[str, dict]] = Field(
         default=None,
-        description="Optional base64-encoded image data for vision tasks. When provided, enables multimodal processing."
+        description="Optional image for vision tasks: a base64 data URL, or a MinIO reference "
+                    "{bucket, object_name[, mode]} resolved inside the worker. When provided, enables multimodal processing."
     )
     structured_output: Optional[dict] = Field(
         default=None,
@@ -60,11 +243,18 @@ class LLMOutput(BaseModel):
     content: Optional[str] = Field(default="", description="主要回复内容")
     reasoning_content: Optional[str] = Field(default="", description="推理过程内容")
     structured_output: Optional[Union[dict, BaseModel]] = Field(default=None, description="结构化输出")
+    metadata: Optional[dict] = Field(
+        default=None,
+        description="调用元数据：model / endpoint / prompt_tokens / completion_tokens / total_tokens / "
+                    "ttfb_ms / latency_ms / cost / cached，见 coper.LLMUsage"
+    )
 
 
 class LLM(Computable):
     """LLM operator based on LiteLLM."""
 
+    idempotent = True
+
     """
     基于LiteLLM封装的LLM调用类。
 
@@ -77,26 +267,57 @@ class LLM(Computable):
     环境变量格式要求：
     - API密钥：{PROVIDER}_API_KEY
     - 基础URL：{PROVIDER}_BASE_URL
+
+    同步调用（compute）与异步调用（acompute，基于 litellm.acompletion）对自定义 Provider
+    共享按 base_url 缓存的 keep-alive 连接池，连接池大小见 LLM_POOL_* 环境变量。
+
+    调用前先从共享令牌桶获取配额（见 core.RateLimiter），限额由 {PROVIDER}_RPM / {PROVIDER}_TPM 等环境变量配置；
+    未使用自定义 Provider 时 PROVIDER 为 LiteLLM 模型名的前缀（如 volcengine/...），没有前缀时为 LITELLM。
+
+    cache 为 True 或 LLMCache 的参数字典时，compute 先查询响应缓存（见 coper.LLMCache）：
+    相同 prompt 直接命中，语义相近的 prompt 在相似度超过阈值时命中。
+
+    每次调用的 token 用量、首字节耗时、总耗时与费用写入返回结果的 metadata，并累计到当前任务的
+    用量账本中（见 coper.LLMUsage，python -m coper.LLMUsage <task_id> 查看报告）。
+
+    图片可以是 data URL，也可以是 MinIO 对象引用 {"bucket": ..., "object_name": ...}（如 Minio 写入的返回值）。
+    引用在 Worker 中解析（见 _resolve_image），任务哈希与 RabbitMQ 消息中不携带图片数据。
+
+    路由模式：routes 为端点列表（如 ["VLLM:Qwen3-32B", "SDU:Qwen3-32B", "volcengine/doubao-..."]），
+    也可以通过环境变量 LLM_ROUTES_{MODEL}（逗号分隔）为逻辑模型名配置。每次调用按最近的延迟与错误率
+    选择端点，超时、连接错误、429 与 5xx 自动切换到下一个端点（见 coper.LLMRouter）。
     """
 
-    def __init__(self, model: str, custom_provider: Optional[str] = None, system_prompt: Optional[str] = None):
-        super().__init__(model, custom_provider)
-        self.model = model
+    def __init__(self, model: str, custom_provider: Optional[str] = None, system_prompt: Optional[str] = None,
+                 cache: Union[bool, dict, None] = None, routes: Optional[list[str]] = None):
+        super().__init__(model, custom_provider, system_prompt, cache=cache, routes=routes)
+        self.name = model
         self.provider = custom_provider
         self.system_prompt = system_prompt
+        self.cache = None
+        if cache:
+            from coper.LLMCache import LLMCache
+            self.cache = LLMCache(**cache) if isinstance(cache, dict) else LLMCache()
 
         # 加载环境变量
         self._load_env()
 
-        # 配置自定义Provider参数
-        if self.provider:
-            self.model = f"openai/{model}"
-            provider_upper = self.provider.upper()
-            self.api_key = os.getenv(f"{provider_upper}_API_KEY")
-            self.base_url = os.getenv(f"{provider_upper}_BASE_URL")
+        if routes is None and not custom_provider:
+            env_routes = os.getenv(f"LLM_ROUTES_{re.sub(r'[^0-9A-Za-z]', '_', model).upper()}")
+            routes = env_routes.split(",") if env_routes else None
+        if routes:
+            self.router = LLMRouter([Endpoint.parse(spec.strip()) for spec in routes])
+            self.endpoint = self.router.endpoints[0]
         else:
-            self.api_key = None
-            self.base_url = None
+            # 配置自定义Provider参数
+            self.router = None
+            self.endpoint = Endpoint(model, custom_provider)
+
+        # 首选端点的配置
+        self.model = self.endpoint.model
+        self.api_key = self.endpoint.api_key
+        self.base_url = self.endpoint.base_url
+        self.limiter = self.endpoint.limiter
 
     def _load_env(self):
         """加载项目根目录下的.env文件"""
@@ -105,6 +326,139 @@ class LLM(Computable):
         if os.path.exists(env_path):
             load_dotenv(dotenv_path=env_path)
 
+    def _messages(self, prompt, image_base64: Optional[str] = None, history: Optional[list] = None):
+        """构造消息列表，history 为插在 system 与本轮 user 消息之间的历史消息（见 coper.LLMSession）。"""
+        system = self.system_prompt if self.system_prompt else "You are a helpful assistant."
+        history = list(history or [])
+        # 以 system 消息开头的历史（如会话摘要）并入 system prompt，部分模型只接受开头的一条 system 消息
+        while history and history[0]["role"] == "system":
+            system = f"{system}\n\n{history.pop(0)['content']}"
+        if image_base64 is None:
+            content = prompt
+        else:
+            content = [
+                {"type": "image_url", "image_url": {"url": image_base64}},
+                {"type": "text", "text": prompt}
+            ]
+        return [
+            {
+                'role': 'system',
+                'content': system
+            },
+            *history,
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+
+    def _request(self, endpoint: Endpoint, prompt, image_base64=None,
+                 structured_model: Optional[type[BaseModel]] = None, history: Optional[list] = None):
+        """litellm.completion / acompletion 的公共参数。"""
+        request = dict(
+            model=endpoint.model,
+            api_key=endpoint.api_key,
+            api_base=endpoint.base_url,
+            allowed_openai_params=['response_format'],
+            response_format=structured_model,
+            messages=self._messages(prompt, image_base64, history),
+            stream=False
+        )
+        if self.router:
+            # 路由模式下及时放弃慢端点，交给下一个端点
+            request["timeout"] = TIMEOUT
+            request["max_retries"] = 0
+        return request
+
+    @property
+    def _retries(self) -> Optional[int]:
+        # 路由模式下失败立即切换端点，不在同一端点上重试
+        return 0 if self.router else None
+
+    def _endpoints(self) -> list[Endpoint]:
+        return self.router.order() if self.router else [self.endpoint]
+
+    @staticmethod
+    def _timing(endpoint: Endpoint, timing: list) -> dict:
+        ended = time.monotonic()
+        return {
+            "endpoint": endpoint,
+            "latency_ms": round((ended - timing[0]) * 1000, 1),
+            "ttfb_ms": round((timing[1] - timing[0]) * 1000, 1) if timing[1] is not None else None,
+        }
+
+    def _complete(self, prompt, image_base64=None, structured_model: Optional[type[BaseModel]] = None,
+                  history: Optional[list] = None):
+        """
+        依次尝试各端点（非路由模式只有一个），返回 (第一个成功的 litellm 响应, 调用信息)，
+        调用信息包含实际使用的 endpoint 与 latency_ms / ttfb_ms。
+        """
+        # 调用litellm接口（litellm 导入耗时数秒，仅在实际调用时导入）
+        import litellm
+        error = None
+        estimated = estimate_tokens(self.system_prompt, prompt, *(m["content"] for m in history or []))
+        for endpoint in self._endpoints():
+            reserved = endpoint.limiter.acquire(estimated)
+            timing = [time.monotonic(), None]
+            token = _call_timing.set(timing)
+            try:
+                client = _sync_client(endpoint.base_url, endpoint.api_key, self._retries) if endpoint.base_url else None
+                response = litellm.completion(
+                    **self._request(endpoint, prompt, image_base64, structured_model, history), client=client
+                )
+            except Exception as e:
+                # 调用失败（切换端点或抛出异常），退回预占的 token
+                endpoint.limiter.settle(reserved, 0)
+                if not self.router or not is_retryable(e):
+                    raise
+                self.router.record(endpoint, timing[0], ok=False)
+                print(f"[WARNING] LLM 端点 {endpoint.id} 调用失败，切换端点: {e}")
+                error = e
+                continue
+            finally:
+                _call_timing.reset(token)
+            call = self._timing(endpoint, timing)
+            if self.router:
+                self.router.record(endpoint, timing[0], ok=True)
+            endpoint.limiter.settle(reserved, self._usage_tokens(response))
+            return response, call
+        raise error
+
+    async def _acomplete(self, prompt, image_base64=None, structured_model: Optional[type[BaseModel]] = None,
+                         history: Optional[list] = None):
+        """_complete 的异步版本。"""
+        import litellm
+        error = None
+        estimated = estimate_tokens(self.system_prompt, prompt, *(m["content"] for m in history or []))
+        # 路由统计读写 Redis，在线程池中执行，不阻塞事件循环
+        endpoints = await asyncio.to_thread(self.router.order) if self.router else [self.endpoint]
+        for endpoint in endpoints:
+            reserved = await endpoint.limiter.aacquire(estimated)
+            timing = [time.monotonic(), None]
+            token = _call_timing.set(timing)
+            try:
+                client = _async_client(endpoint.base_url, endpoint.api_key, self._retries) if endpoint.base_url else None
+                response = await litellm.acompletion(
+                    **self._request(endpoint, prompt, image_base64, structured_model, history), client=client
+                )
+            except Exception as e:
+                # 调用失败（切换端点或抛出异常），退回预占的 token
+                await endpoint.limiter.asettle(reserved, 0)
+                if not self.router or not is_retryable(e):
+                    raise
+                await asyncio.to_thread(self.router.record, endpoint, timing[0], False)
+                print(f"[WARNING] LLM 端点 {endpoint.id} 调用失败，切换端点: {e}")
+                error = e
+                continue
+            finally:
+                _call_timing.reset(token)
+            call = self._timing(endpoint, timing)
+            if self.router:
+                await asyncio.to_thread(self.router.record, endpoint, timing[0], True)
+            await endpoint.limiter.asettle(reserved, self._usage_tokens(response))
+            return response, call
+        raise error
+
     def language_llm(self, prompt, structured_model: Optional[type[BaseModel]] = None):
         """Invoke the LLM for language tasks.
 
@@ -115,82 +469,82 @@ class LLM(Computable):
         Returns:
             A dictionary representation of :class:`LLMResponse`.
         """
-        # 调用litellm接口
-        response = litellm.completion(
-            model=self.model,
-            api_key=self.api_key,
-            api_base=self.base_url,
-            allowed_openai_params=['response_format'],
-            response_format=structured_model,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': self.system_prompt if self.system_prompt else "You are a helpful assistant."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            stream=False
-        )
-        return response
+        return self._complete(prompt, None, structured_model)[0]
 
-    def vision_llm(self, prompt: str, image_base64: str, structured_model: Optional[type[BaseModel]] = None):
+    def vision_llm(self, prompt: str, image_base64: Union[str, dict],
+                   structured_model: Optional[type[BaseModel]] = None):
         """Invoke the LLM for vision tasks.
 
         Args:
             prompt: Text prompt sent to the model.
-            image_base64: Base64 encoded image data.
+            image_base64: Base64 encoded image data, or a MinIO ``{bucket, object_name}`` reference.
 
         Returns:
             A dictionary representation of :class:`LLMResponse`.
         """
 
-        # 调用litellm接口
-        response = litellm.completion(
-            model=self.model,
-            api_key=self.api_key,
-            api_base=self.base_url,
-            allowed_openai_params=['response_format'],
-            response_format=structured_model,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': self.system_prompt if self.system_prompt else "You are a helpful assistant."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image_url", "image_url": {"url": image_base64}},
-                        {"type": "text", "text": prompt}
-                    ]
-                }
-            ],
-            stream=False
-        )
-        return response
-
-    def compute(self, prompt: str, image_base64: Optional[str] = None, structured_output: Optional[dict] = None) -> dict:
-        """Invoke the LLM and return the response.
-
-        Args:
-            prompt: Text prompt sent to the model.
-            structured_output: Optional JSON schema describing structured output.
+        return self._complete(prompt, self._resolve_image(image_base64)[0], structured_model)[0]
 
-        Returns:
-            A dictionary representation of :class:`LLMResponse`.
+    def _resolve_image(self, image: Union[str, dict, None]) -> tuple[Optional[str], Optional[str]]:
+        """
+        把图片参数解析为发送给模型的 URL，返回 (url, 缓存键)。
+        MinIO 引用按 image["mode"]（默认 LLM_IMAGE_MODE）解析：
+            inline  读取对象并编码为 data URL，缓存键为 data URL 本身
+            url     生成有效期 LLM_IMAGE_URL_EXPIRY 秒的预签名 URL，要求模型端点能访问 MinIO；
+                    预签名 URL 每次不同，缓存键使用 minio://{bucket}/{object_name}
         """
+        if not isinstance(image, dict):
+            return image, image
+        bucket, object_name = image["bucket"], image["object_name"]
+        mode = image.get("mode", IMAGE_MODE)
+        if mode == "url":
+            from datetime import timedelta
+            url = self.ctx.minio.presigned_get_object(bucket, object_name, expires=timedelta(seconds=IMAGE_URL_EXPIRY))
+            return url, f"minio://{bucket}/{object_name}"
+        if mode != "inline":
+            raise ValueError(f"Unknown image mode {mode!r}, expected 'inline' or 'url'")
+        from coper.Minio import Minio
+        data_url = Minio().read(bucket, object_name, output_format="base64")
+        if data_url is None:
+            raise ValueError(f"Image {bucket}/{object_name} not found in MinIO")
+        return data_url, data_url
+
+    @staticmethod
+    def _structured_model(structured_output: Optional[dict]) -> Optional[Type[BaseModel]]:
         # 若提供了结构化JSON Schema，则将其转换为Pydantic模型
-        structured_model: Optional[Type[BaseModel]] = None
         if structured_output:
-            structured_model = restore_model_from_schema(structured_output)
-
-        if image_base64 is None:
-            llm_response = self.language_llm(prompt, structured_model)
-        else:
-            llm_response = self.vision_llm(prompt, image_base64, structured_model)
-
+            return restore_model_from_schema(structured_output)
+        return None
+
+    @staticmethod
+    def _usage_tokens(llm_response) -> Optional[int]:
+        usage = getattr(llm_response, "usage", None)
+        return getattr(usage, "total_tokens", None) if usage else None
+
+    def _account(self, llm_response, call, prompt) -> dict:
+        """生成调用元数据并计入当前任务的用量账本（不在任务中运行时只返回元数据）。"""
+        metadata = LLMUsage.metadata(call["endpoint"], llm_response, call)
+        self._record_usage(metadata, prompt)
+        return metadata
+
+    async def _aaccount(self, llm_response, call, prompt) -> dict:
+        """_account 的异步版本，Redis 写入在线程池中执行，不阻塞事件循环。"""
+        metadata = LLMUsage.metadata(call["endpoint"], llm_response, call)
+        if self.ctx.task_id is not None:
+            await asyncio.to_thread(self._record_usage, metadata, prompt)
+        return metadata
+
+    def _record_usage(self, metadata, prompt):
+        if self.ctx.task_id is None:
+            return
+        try:
+            LLMUsage.record(self.redis, self.ctx.task_id, metadata, prompt)
+        except Exception as e:
+            # 记账失败不影响调用结果
+            print(f"[WARNING] LLM 用量记录失败: {e}")
+
+    @staticmethod
+    def _output(llm_response, structured_model: Optional[Type[BaseModel]], metadata: Optional[dict] = None) -> dict:
         message = llm_response['choices'][0]['message']
         content = message.get("content", "")
         reasoning = message.get("reasoning_content", "")
@@ -204,7 +558,83 @@ class LLM(Computable):
         llm_response = LLMOutput(
             content=content if not structured_model else None,
             reasoning_content=reasoning if not structured_model else None,
-            structured_output=structured
+            structured_output=structured,
+            metadata=metadata
         )
 
         return llm_response.model_dump()
+
+    def compute(self, prompt: str, image_base64: Union[str, dict, None] = None,
+                structured_output: Optional[dict] = None) -> dict:
+        """Invoke the LLM and return the response.
+
+        Args:
+            prompt: Text prompt sent to the model.
+            image_base64: Optional data URL, or a MinIO ``{bucket, object_name}`` reference.
+            structured_output: Optional JSON schema describing structured output.
+
+        Returns:
+            A dictionary representation of :class:`LLMResponse`.
+        """
+        structured_model = self._structured_model(structured_output)
+        image_url, image_key = self._resolve_image(image_base64)
+
+        if self.cache:
+            started = time.monotonic()
+            scope = self.cache.scope(self.model, self.base_url, self.system_prompt, structured_output)
+            cached, vector = self.cache.lookup(scope, prompt, image_key)
+            if cached is not None:
+                return self._cached_output(cached, started, prompt)
+
+        llm_response, call = self._complete(prompt, image_url, structured_model)
+        output = self._output(llm_response, structured_model, self._account(llm_response, call, prompt))
+        if self.cache:
+            self.cache.store(scope, prompt, output, image_key, vector)
+        return output
+
+    async def _aresolve_image(self, image):
+        """_resolve_image 的异步版本，读取 MinIO 的阻塞调用放到线程池中执行。"""
+        if not isinstance(image, dict):
+            return image, image
+        return await asyncio.to_thread(self._resolve_image, image)
+
+    def _cached_output(self, cached: dict, started: float, prompt) -> dict:
+        """缓存命中：不消耗 token，元数据中保留原调用的模型与端点。"""
+        original = cached.get("metadata") or {}
+        metadata = {
+            "model": original.get("model", self.model),
+            "endpoint": original.get("endpoint", self.endpoint.id),
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "ttfb_ms": None,
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            "cost": 0.0,
+            "cached": True,
+        }
+        self._record_usage(metadata, prompt)
+        return {**cached, "metadata": metadata}
+
+    async def acompute(self, prompt: str, image_base64: Union[str, dict, None] = None,
+                       structured_output: Optional[dict] = None) -> dict:
+        """Async counterpart of :meth:`compute` based on ``litellm.acompletion``.
+
+        Calls from the same event loop share one keep-alive connection pool per
+        base URL, so hundreds of concurrent completions can run in one process.
+        The response cache is consulted in a worker thread, off the event loop.
+        """
+        structured_model = self._structured_model(structured_output)
+        image_url, image_key = await self._aresolve_image(image_base64)
+
+        if self.cache:
+            started = time.monotonic()
+            scope = self.cache.scope(self.model, self.base_url, self.system_prompt, structured_output)
+            cached, vector = await asyncio.to_thread(self.cache.lookup, scope, prompt, image_key)
+            if cached is not None:
+                return await asyncio.to_thread(self._cached_output, cached, started, prompt)
+
+        llm_response, call = await self._acomplete(prompt, image_url, structured_model)
+        output = self._output(llm_response, structured_model, await self._aaccount(llm_response, call, prompt))
+        if self.cache:
+            await asyncio.to_thread(self.cache.store, scope, prompt, output, image_key, vector)
+        return output
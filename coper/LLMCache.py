@@ -0,0 +1,197 @@
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Optional
+
+from core import Metrics
+from core.Context import get_context
+from core.Utils import deserialize, serialize
+
+CACHE_REQUESTS = Metrics.Counter("llm_cache_requests_total", "LLM cache lookups", ["result"])
+
+STATS_KEY = "llm-cache-stats"
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class LLMCache:
+    """
+    LLM 响应缓存，两级查找：
+
+    1. 精确匹配：按 (作用域, prompt) 的哈希直接读取 Redis，一次往返；
+    2. 语义匹配：用 coper.Embedding 计算 prompt 向量，在 Milvus 中检索同一作用域下最相近的历史 prompt，
+       余弦相似度不低于 threshold 时返回其缓存结果。带图片的请求只走精确匹配。
+
+    作用域由模型、Provider 地址、system prompt 与结构化输出 schema 共同决定，
+    不同配置之间的结果不会互相命中。
+
+    Redis 结构：
+        llm-cache:{scope}:{prompt_hash}   hash：response（序列化的 LLMOutput）/ vector_id，ttl 秒后过期
+        llm-cache-index:{scope}           zset：prompt_hash -> 最近访问时间，超过 max_entries 时淘汰最久未访问的条目
+        llm-cache-stats                   hash：exact_hit / semantic_hit / miss / store / error 计数
+
+    淘汰策略：ttl（LLM_CACHE_TTL，默认 1 天，0 表示不过期）与 max_entries
+    （LLM_CACHE_MAX_ENTRIES，每个作用域的条目上限，默认 10000，0 表示不限制，按 LRU 淘汰）。
+    Milvus 中过期条目的向量在被命中时惰性删除。
+    """
+
+    def __init__(self, threshold: Optional[float] = None, ttl: Optional[int] = None,
+                 max_entries: Optional[int] = None, semantic: bool = True,
+                 collection: Optional[str] = None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("LLM_CACHE_THRESHOLD", "0.95"))
+        self.ttl = ttl if ttl is not None else int(os.getenv("LLM_CACHE_TTL", "86400"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        self.semantic = semantic
+        self.collection = collection or os.getenv("LLM_CACHE_COLLECTION", "llm_semantic_cache")
+        self._collection_ready = False
+
+    @property
+    def redis(self):
+        return get_context().redis
+
+    @staticmethod
+    def scope(model, base_url, system_prompt, structured_output) -> str:
+        """缓存作用域：同一作用域内的相同 / 相似 prompt 才会命中。"""
+        schema = json.dumps(structured_output, sort_keys=True) if structured_output else ""
+        return _sha256("\x00".join([model or "", base_url or "", system_prompt or "", schema]))[:32]
+
+    @staticmethod
+    def prompt_hash(prompt, image_base64=None) -> str:
+        return _sha256(prompt if image_base64 is None else f"{prompt}\x00{_sha256(image_base64)}")
+
+    def _record(self, result):
+        CACHE_REQUESTS.inc(result=result)
+        self.redis.hincrby(STATS_KEY, result, 1)
+
+    def _entry_key(self, scope, prompt_hash):
+        return f"llm-cache:{scope}:{prompt_hash}"
+
+    def _load(self, scope, prompt_hash):
+        raw = self.redis.hget(self._entry_key(scope, prompt_hash), "response")
+        if raw is None:
+            return None
+        self.redis.zadd(f"llm-cache-index:{scope}", {prompt_hash: time.time()})
+        return deserialize(raw)
+
+    def _embed(self, prompt):
+        from coper.Embedding import Embedding
+        vector = Embedding().compute(prompt)
+        if not vector:
+            raise RuntimeError("Embedding request failed")
+        return _normalize(vector)
+
+    def _ensure_collection(self, vector_db, dimension):
+        if self._collection_ready:
+            return
+        from pymilvus import utility
+        if not utility.has_collection(self.collection, using=vector_db.using):
+            vector_db.create_collection(self.collection, dimension)
+            # 向量已归一化，L2 距离与余弦相似度一一对应
+            vector_db.create_index(self.collection, {
+                "index_type": "IVF_FLAT", "params": {"nlist": 128}, "metric_type": "L2"
+            })
+        self._collection_ready = True
+
+    def lookup(self, scope, prompt, image_base64=None):
+        """
+        查找缓存，返回 (response, vector)。response 为缓存的 LLMOutput 字典，未命中时为 None；
+        vector 为语义查找时计算出的 prompt 向量，写入缓存时复用。
+        """
+        prompt_hash = self.prompt_hash(prompt, image_base64)
+        try:
+            response = self._load(scope, prompt_hash)
+            if response is not None:
+                self._record("exact_hit")
+                return response, None
+            if not self.semantic or image_base64 is not None:
+                self._record("miss")
+                return None, None
+
+            from coper.VectorDB import VectorDBOperations
+            vector_db = VectorDBOperations()
+            vector = self._embed(prompt)
+            self._ensure_collection(vector_db, len(vector))
+            hits = vector_db.search_vector(self.collection, vector, top_k=1, expr=f'label == "{scope}"')
+            if hits:
+                vector_id, hit_hash, _, distance = hits[0]
+                # 归一化向量的 L2 距离（Milvus 返回平方距离）与余弦相似度：cos = 1 - d / 2
+                if 1 - distance / 2 >= self.threshold:
+                    response = self._load(scope, hit_hash)
+                    if response is not None:
+                        self._record("semantic_hit")
+                        return response, vector
+                    # 条目已过期，删除残留的向量
+                    vector_db.delete_vector(self.collection, vector_id, flush=False)
+            self._record("miss")
+            return None, vector
+        except Exception as e:
+            # 缓存不可用时不影响正常调用
+            print(f"[WARNING] LLM 缓存查找失败: {e}")
+            self._record("error")
+            return None, None
+
+    def store(self, scope, prompt, response, image_base64=None, vector=None):
+        """写入缓存并按 max_entries 淘汰最久未访问的条目。"""
+        prompt_hash = self.prompt_hash(prompt, image_base64)
+        try:
+            entry = {"response": serialize(response)[1]}
+            if self.semantic and image_base64 is None:
+                from coper.VectorDB import VectorDBOperations
+                vector_db = VectorDBOperations()
+                vector = vector or self._embed(prompt)
+                self._ensure_collection(vector_db, len(vector))
+                # 不 flush：Milvus 的增长段可以直接检索，逐条同步 flush 会给每次未命中增加数秒延迟
+                entry["vector_id"] = vector_db.insert_vector(
+                    self.collection, [vector], [prompt_hash], [scope], flush=False
+                )[0]
+
+            index_key = f"llm-cache-index:{scope}"
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(self._entry_key(scope, prompt_hash), mapping=entry)
+            if self.ttl:
+                pipe.expire(self._entry_key(scope, prompt_hash), self.ttl)
+            pipe.zadd(index_key, {prompt_hash: time.time()})
+            pipe.execute()
+            self._record("store")
+            if self.max_entries:
+                self._evict(scope, index_key)
+        except Exception as e:
+            print(f"[WARNING] LLM 缓存写入失败: {e}")
+            self._record("error")
+
+    def _evict(self, scope, index_key):
+        overflow = self.redis.zcard(index_key) - self.max_entries
+        if overflow <= 0:
+            return
+        evicted = self.redis.zpopmin(index_key, overflow)
+        vector_ids = []
+        for prompt_hash, _ in evicted:
+            key = self._entry_key(scope, prompt_hash)
+            vector_id = self.redis.hget(key, "vector_id")
+            if vector_id is not None:
+                vector_ids.append(int(vector_id))
+            self.redis.delete(key)
+        if vector_ids:
+            from coper.VectorDB import VectorDBOperations
+            VectorDBOperations().delete_vectors(self.collection, vector_ids, flush=False)
+
+    def stats(self) -> dict:
+        """返回命中统计：exact_hit / semantic_hit / miss / store / error 以及 hit_rate。"""
+        stats = {k: int(v) for k, v in self.redis.hgetall(STATS_KEY).items()}
+        for name in ("exact_hit", "semantic_hit", "miss", "store", "error"):
+            stats.setdefault(name, 0)
+        lookups = stats["exact_hit"] + stats["semantic_hit"] + stats["miss"]
+        stats["hit_rate"] = (stats["exact_hit"] + stats["semantic_hit"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear_stats(self):
+        self.redis.delete(STATS_KEY)
@@ -0,0 +1,136 @@
+import os
+import random
+import time
+from typing import Optional
+
+from core import Metrics
+from core.Context import get_context
+from core.RateLimiter import RateLimiter
+
+ROUTE_REQUESTS = Metrics.Counter("llm_route_requests_total", "LLM calls per endpoint", ["endpoint", "result"])
+
+#: 每个端点保留的最近调用样本数
+SAMPLES = int(os.getenv("LLM_ROUTE_SAMPLES", "50"))
+#: 探索概率：以该概率随机选择首选端点，使表现较差的端点有机会恢复
+EXPLORE = float(os.getenv("LLM_ROUTE_EXPLORE", "0.05"))
+#: 路由模式下单个端点的超时时间（秒），超时后切换到下一个端点
+TIMEOUT = float(os.getenv("LLM_ROUTE_TIMEOUT", "60"))
+#: 错误率对评分的惩罚系数：score = 平均延迟 * (1 + ERROR_PENALTY * 错误率)，
+#: 平均延迟中每次失败按 TIMEOUT 计（失败通常很快返回，按实际耗时计会让宕机的端点排在最前）
+ERROR_PENALTY = float(os.getenv("LLM_ROUTE_ERROR_PENALTY", "10"))
+
+
+class Endpoint:
+    """
+    一个可调用的模型端点。spec 的格式为：
+        "PROVIDER:model"   OpenAI 兼容的自定义 Provider，读取 {PROVIDER}_API_KEY / {PROVIDER}_BASE_URL
+        "provider/model"   LiteLLM 原生支持的模型名
+    """
+
+    def __init__(self, model: str, provider: Optional[str] = None):
+        self.provider = provider
+        if provider:
+            self.model = f"openai/{model}"
+            self.api_key = os.getenv(f"{provider.upper()}_API_KEY")
+            self.base_url = os.getenv(f"{provider.upper()}_BASE_URL")
+            self.limiter = RateLimiter(provider, model)
+        else:
+            self.model = model
+            self.api_key = None
+            self.base_url = None
+            self.limiter = RateLimiter(*model.split("/", 1)) if "/" in model else RateLimiter("LITELLM", model)
+        self.id = f"{provider}:{model}" if provider else model
+
+    @classmethod
+    def parse(cls, spec: str) -> "Endpoint":
+        provider, sep, model = spec.partition(":")
+        return cls(model, provider) if sep else cls(spec)
+
+    def __repr__(self):
+        return f"Endpoint({self.id})"
+
+
+def is_retryable(e: Exception) -> bool:
+    """超时、连接错误、429 与 5xx 可以切换端点重试，其余错误（如 400）直接抛出。"""
+    status = getattr(e, "status_code", None)
+    if status is None:
+        return type(e).__name__ in ("Timeout", "APIConnectionError", "APITimeoutError", "ConnectError",
+                                    "ReadTimeout", "ConnectTimeout", "TimeoutError", "ConnectionError")
+    return status in (408, 429) or status >= 500
+
+
+class LLMRouter:
+    """
+    一个逻辑模型对应多个端点时的路由：按最近调用的平均延迟与错误率为端点评分，依次尝试，
+    可重试的失败（见 is_retryable）记为错误并切换到下一个端点。
+
+    最近样本保存在 Redis 列表 llm-route:{endpoint} 中（"ok:<毫秒>" / "err:<毫秒>"），
+    所有 Runner 进程共享同一份统计；没有样本的端点优先尝试。
+    """
+
+    def __init__(self, endpoints: list[Endpoint]):
+        if not endpoints:
+            raise ValueError("LLMRouter requires at least one endpoint")
+        self.endpoints = endpoints
+
+    @staticmethod
+    def _key(endpoint: Endpoint) -> str:
+        return f"llm-route:{endpoint.id}"
+
+    @staticmethod
+    def score(samples: list[str]) -> float:
+        if not samples:
+            return 0.0
+        total = 0.0
+        errors = 0
+        for sample in samples:
+            kind, _, ms = sample.partition(":")
+            if kind == "err":
+                errors += 1
+                total += TIMEOUT * 1000
+            else:
+                total += float(ms)
+        return total / len(samples) * (1 + ERROR_PENALTY * errors / len(samples))
+
+    def stats(self) -> dict:
+        """各端点的样本数、成功调用的平均延迟（毫秒）、错误率与评分。"""
+        redis = get_context().redis
+        pipe = redis.pipeline(transaction=False)
+        for endpoint in self.endpoints:
+            pipe.lrange(self._key(endpoint), 0, -1)
+        rv = {}
+        for endpoint, samples in zip(self.endpoints, pipe.execute()):
+            # 平均延迟只统计成功的调用
+            latencies = [float(s.partition(":")[2]) for s in samples if s.startswith("ok")]
+            rv[endpoint.id] = {
+                "samples": len(samples),
+                "latency_ms": sum(latencies) / len(latencies) if latencies else None,
+                "error_rate": sum(s.startswith("err") for s in samples) / len(samples) if samples else None,
+                "score": self.score(samples),
+            }
+        return rv
+
+    def order(self) -> list[Endpoint]:
+        """按评分从好到差排列端点；以 EXPLORE 的概率把一个随机端点放到最前。"""
+        if len(self.endpoints) == 1:
+            return list(self.endpoints)
+        redis = get_context().redis
+        pipe = redis.pipeline(transaction=False)
+        for endpoint in self.endpoints:
+            pipe.lrange(self._key(endpoint), 0, -1)
+        scores = [self.score(samples) for samples in pipe.execute()]
+        ranked = [e for _, _, e in sorted(zip(scores, range(len(scores)), self.endpoints))]
+        if random.random() < EXPLORE:
+            pick = ranked.pop(random.randrange(len(ranked)))
+            ranked.insert(0, pick)
+        return ranked
+
+    def record(self, endpoint: Endpoint, started: float, ok: bool):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        ROUTE_REQUESTS.inc(endpoint=endpoint.id, result="ok" if ok else "error")
+        key = self._key(endpoint)
+        pipe = get_context().redis.pipeline(transaction=False)
+        pipe.lpush(key, f"{'ok' if ok else 'err'}:{elapsed_ms:.0f}")
+        pipe.ltrim(key, 0, SAMPLES - 1)
+        pipe.expire(key, 3600)
+        pipe.execute()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Optional, Union
+
+from core.RateLimiter import estimate_tokens
+from coper.LLM import LLM
+
+#: 历史压缩策略：trim 丢弃最早的轮次；summarize 把较早的轮次总结为摘要；none 不压缩
+POLICIES = ("trim", "summarize", "none")
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own future reference. Keep every fact, decision, "
+    "open question and user preference that later turns may depend on; drop small talk. "
+    "Use at most {words} words and reply with the summary only.\n\n{conversation}"
+)
+
+
+class LLMSession(LLM):
+    """
+    多轮对话会话：消息历史保存在 Redis 中，每次调用只携带本轮 prompt，
+    Worker 读取历史、调用模型并把本轮问答追加到历史，任务哈希与 RabbitMQ 消息的大小不随轮数增长。
+
+        session = LLMSession("Qwen3-32B", "VLLM", system_prompt="...", policy="summarize")
+        first = session("Hi, I'm planning a trip to Jinan.")
+        second = session("What should I see there?", after=first)   # after 保证轮次顺序
+
+    同一会话的轮次必须依次执行：先等待上一轮的结果（.result()），或把上一轮的结果作为 after 参数传入。
+
+    历史压缩（每轮结束后执行，使下一轮的历史不超过 max_tokens 个估算 token）：
+        trim        丢弃最早的问答对（默认）
+        summarize   保留最近 keep_recent 条消息，更早的消息与已有摘要一起由模型总结为新的摘要，
+                    摘要并入 system prompt，长度不超过 max_tokens 的一半
+        none        不压缩
+
+    参数默认值读取环境变量 LLM_SESSION_POLICY / LLM_SESSION_MAX_TOKENS（默认 4000）/
+    LLM_SESSION_KEEP_RECENT（默认 6）/ LLM_SESSION_TTL（秒，默认 1 天，每轮刷新）。
+
+    redis data structure:
+        list: llm-session-messages:{session_id}   历史消息（JSON：role / content），图片不入历史
+        hash: llm-session:{session_id}            summary / turns
+    """
+
+    # 每轮都会修改历史，重复执行会写入重复的轮次
+    idempotent = False
+
+    def __init__(self, model: str, custom_provider: Optional[str] = None, system_prompt: Optional[str] = None,
+                 session_id: Optional[str] = None, policy: Optional[str] = None, max_tokens: Optional[int] = None,
+                 keep_recent: Optional[int] = None, routes: Optional[list[str]] = None):
+        super().__init__(model, custom_provider, system_prompt, routes=routes)
+        self.session_id = session_id or uuid.uuid4().hex
+        self.policy = policy or os.getenv("LLM_SESSION_POLICY", "trim")
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown session policy {self.policy!r}, expected one of {POLICIES}")
+        self.max_tokens = max_tokens if max_tokens is not None else int(os.getenv("LLM_SESSION_MAX_TOKENS", "4000"))
+        self.keep_recent = keep_recent if keep_recent is not None else int(os.getenv("LLM_SESSION_KEEP_RECENT", "6"))
+        self.ttl = int(os.getenv("LLM_SESSION_TTL", "86400"))
+        # Worker 用同一 session_id 重建会话
+        self.init_kwargs = {
+            "session_id": self.session_id, "policy": policy, "max_tokens": max_tokens,
+            "keep_recent": keep_recent, "routes": routes,
+        }
+
+    @property
+    def _messages_key(self):
+        return f"llm-session-messages:{self.session_id}"
+
+    @property
+    def _state_key(self):
+        return f"llm-session:{self.session_id}"
+
+    def history(self) -> dict:
+        """返回 {"summary": 摘要或 None, "messages": 历史消息列表, "turns": 已完成的轮数}。"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lrange(self._messages_key, 0, -1)
+        pipe.hgetall(self._state_key)
+        messages, state = pipe.execute()
+        return {
+            "summary": state.get("summary"),
+            "messages": [json.loads(m) for m in messages],
+            "turns": int(state.get("turns", 0)),
+        }
+
+    def clear(self):
+        self.redis.delete(self._messages_key, self._state_key)
+
+    def _context(self) -> list:
+        """本轮发送给模型的历史：摘要（作为 system 消息并入 system prompt）+ 保留的消息。"""
+        state = self.history()
+        context = state["messages"]
+        if state["summary"]:
+            summary = f"Summary of the earlier conversation:\n{state['summary']}"
+            context.insert(0, {"role": "system", "content": summary})
+        return context
+
+    @staticmethod
+    def _reply_text(output: dict) -> str:
+        if output.get("structured_output") is not None:
+            return json.dumps(output["structured_output"], ensure_ascii=False)
+        return output.get("content") or ""
+
+    def _append(self, prompt, image_base64, output):
+        user = prompt if image_base64 is None else f"{prompt}\n[image]"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(self._messages_key,
+                   json.dumps({"role": "user", "content": user}, ensure_ascii=False),
+                   json.dumps({"role": "assistant", "content": self._reply_text(output)}, ensure_ascii=False))
+        pipe.hincrby(self._state_key, "turns", 1)
+        pipe.execute()
+
+    def _overflow(self, messages) -> int:
+        """为使历史不超过 max_tokens 需要移出的最早消息数（按问答对计，至少保留最近一轮）。"""
+        sizes = [estimate_tokens(m["content"]) for m in messages]
+        total = sum(sizes)
+        drop = 0
+        while total > self.max_tokens and len(messages) - drop > 2:
+            total -= sizes[drop] + sizes[drop + 1]
+            drop += 2
+        return drop
+
+    def _compact_plan(self):
+        """返回 (需要移出的消息, 已有摘要)；不需要压缩时消息列表为空。"""
+        if self.policy == "none":
+            return [], None
+        state = self.history()
+        messages = state["messages"]
+        drop = self._overflow(messages)
+        if self.policy == "summarize" and drop:
+            # 摘要时一次移出 keep_recent 之前的全部消息，避免每轮都调用一次总结
+            drop = max(drop, len(messages) - self.keep_recent)
+            drop -= drop % 2
+        return messages[:drop], state["summary"]
+
+    def _summary_prompt(self, dropped, summary) -> str:
+        lines = [f"Earlier summary: {summary}"] if summary else []
+        lines.extend(f"{m['role']}: {m['content']}" for m in dropped)
+        return SUMMARY_PROMPT.format(words=self.max_tokens // 2, conversation="\n".join(lines))
+
+    def _summary(self, response, summary) -> str:
+        content = response['choices'][0]['message'].get("content") or summary
+        # 模型不遵守字数要求时截断（约 4 个字符一个 token），保证摘要不随轮数增长
+        return content[:self.max_tokens // 2 * 4]
+
+    def _apply_compaction(self, dropped, summary=None):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.ltrim(self._messages_key, len(dropped), -1)
+        if summary is not None:
+            pipe.hset(self._state_key, "summary", summary)
+        if self.ttl:
+            pipe.expire(self._messages_key, self.ttl)
+            pipe.expire(self._state_key, self.ttl)
+        pipe.execute()
+
+    def _compact(self):
+        dropped, summary = self._compact_plan()
+        if dropped and self.policy == "summarize":
+            prompt = self._summary_prompt(dropped, summary)
+            response, call = self._complete(prompt)
+            self._account(response, call, prompt)
+            summary = self._summary(response, summary)
+        self._apply_compaction(dropped, summary)
+
+    async def _acompact(self):
+        # Redis 读写在线程池中执行，不阻塞事件循环
+        dropped, summary = await asyncio.to_thread(self._compact_plan)
+        if dropped and self.policy == "summarize":
+            prompt = self._summary_prompt(dropped, summary)
+            response, call = await self._acomplete(prompt)
+            await self._aaccount(response, call, prompt)
+            summary = self._summary(response, summary)
+        await asyncio.to_thread(self._apply_compaction, dropped, summary)
+
+    def compute(self, prompt: str, image_base64: Union[str, dict, None] = None,
+                structured_output: Optional[dict] = None, after=None) -> dict:
+        """执行一轮对话。after 只用于声明对上一轮结果的依赖，保证同一会话的轮次依次执行。"""
+        structured_model = self._structured_model(structured_output)
+        image_url, _ = self._resolve_image(image_base64)
+        llm_response, call = self._complete(prompt, image_url, structured_model, self._context())
+        output = self._output(llm_response, structured_model, self._account(llm_response, call, prompt))
+        self._append(prompt, image_base64, output)
+        self._compact()
+        return output
+
+    async def acompute(self, prompt: str, image_base64: Union[str, dict, None] = None,
+                       structured_output: Optional[dict] = None, after=None) -> dict:
+        """compute 的异步版本，历史的 Redis 读写在线程池中执行。"""
+        structured_model = self._structured_model(structured_output)
+        image_url, _ = await self._aresolve_image(image_base64)
+        context = await asyncio.to_thread(self._context)
+        llm_response, call = await self._acomplete(prompt, image_url, structured_model, context)
+        output = self._output(llm_response, structured_model, await self._aaccount(llm_response, call, prompt))
+        await asyncio.to_thread(self._append, prompt, image_base64, output)
+        await self._acompact()
+        return output
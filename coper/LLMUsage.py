@@ -0,0 +1,199 @@
+"""
+LLM 调用的 token、耗时与费用账本。
+
+每次 LLM.compute / acompute 调用都会生成一份元数据（同时写入返回结果的 metadata 字段）：
+    model / endpoint          实际调用的模型与端点
+    prompt_tokens / completion_tokens / total_tokens
+    ttfb_ms                   首字节耗时（收到响应头），仅连接池管理的 OpenAI 兼容端点可以测量
+    latency_ms                总耗时
+    cost                      费用（美元）：优先使用 {PROVIDER}[_{MODEL}]_PRICE 环境变量
+                              （"输入单价,输出单价"，每百万 token），否则使用 litellm 的价格表
+    cached                    是否命中响应缓存
+
+redis data structure:
+    stream: llm-usage:{task_id}        每次调用一条记录，另含 prompt（前 120 个字符）
+    hash:   llm-usage-total:{task_id}  calls / cached_calls / prompt_tokens / completion_tokens / latency_ms / cost
+    zset:   llm-usage-tasks            task_id -> 累计 token 数
+
+用法：
+    python -m coper.LLMUsage <task_id> [--top N]   单个任务的汇总、按模型统计、最耗 token 的 prompt 与最慢的调用
+    python -m coper.LLMUsage --tasks [--top N]     累计 token 最多的任务
+"""
+import os
+import re
+
+#: 单个任务最多保留的调用记录数（近似裁剪）
+USAGE_MAXLEN = 100000
+#: 记录中保留的 prompt 长度
+PROMPT_PREVIEW = 120
+
+
+def usage_key(task_id):
+    return f"llm-usage:{task_id}"
+
+
+def _env_name(name):
+    return re.sub(r"[^0-9A-Za-z]", "_", name).upper()
+
+
+def _price(provider, model):
+    """读取 {PROVIDER}_{MODEL}_PRICE 或 {PROVIDER}_PRICE，返回 (输入单价, 输出单价)（美元 / 百万 token）。"""
+    for name in (f"{_env_name(provider)}_{_env_name(model)}_PRICE", f"{_env_name(provider)}_PRICE"):
+        value = os.getenv(name)
+        if value:
+            prompt_price, _, completion_price = value.partition(",")
+            return float(prompt_price), float(completion_price or prompt_price)
+    return None
+
+
+def cost(endpoint, response, prompt_tokens, completion_tokens):
+    price = _price(endpoint.limiter.provider, endpoint.limiter.model)
+    if price is not None:
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+    try:
+        import litellm
+        return float(litellm.completion_cost(completion_response=response))
+    except Exception:
+        # 自部署模型没有价格表
+        return None
+
+
+def metadata(endpoint, response, call) -> dict:
+    """根据 litellm 响应与调用耗时生成元数据。"""
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    return {
+        "model": endpoint.model,
+        "endpoint": endpoint.id,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": getattr(usage, "total_tokens", None) or prompt_tokens + completion_tokens,
+        "ttfb_ms": call["ttfb_ms"],
+        "latency_ms": call["latency_ms"],
+        "cost": cost(endpoint, response, prompt_tokens, completion_tokens),
+        "cached": False,
+    }
+
+
+def record(redis, task_id, meta, prompt):
+    """把一次调用计入任务账本。"""
+    fields = {k: "" if v is None else str(v) for k, v in meta.items()}
+    fields["prompt"] = (prompt or "")[:PROMPT_PREVIEW]
+    total_key = f"llm-usage-total:{task_id}"
+    pipe = redis.pipeline(transaction=False)
+    pipe.xadd(usage_key(task_id), fields, maxlen=USAGE_MAXLEN, approximate=True)
+    pipe.hincrby(total_key, "calls", 1)
+    pipe.hincrby(total_key, "cached_calls", int(bool(meta["cached"])))
+    pipe.hincrby(total_key, "prompt_tokens", meta["prompt_tokens"])
+    pipe.hincrby(total_key, "completion_tokens", meta["completion_tokens"])
+    pipe.hincrbyfloat(total_key, "latency_ms", meta["latency_ms"] or 0)
+    pipe.hincrbyfloat(total_key, "cost", meta["cost"] or 0)
+    pipe.zincrby("llm-usage-tasks", meta["prompt_tokens"] + meta["completion_tokens"], task_id)
+    pipe.execute()
+
+
+def load(redis, task_id):
+    """读取任务的全部调用记录。"""
+    calls = []
+    for _, fields in redis.xrange(usage_key(task_id)):
+        call = dict(fields)
+        for k in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            call[k] = int(call.get(k) or 0)
+        for k in ("ttfb_ms", "latency_ms", "cost"):
+            call[k] = float(call[k]) if call.get(k) else None
+        call["cached"] = call.get("cached") == "True"
+        calls.append(call)
+    return calls
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _fmt(value, width=10, digits=1):
+    return f"{'-':>{width}}" if value is None else f"{value:{width}.{digits}f}"
+
+
+def report(calls, top=10):
+    lines = []
+    tokens = sum(c["total_tokens"] for c in calls)
+    spent = sum(c["cost"] or 0 for c in calls)
+    lines.append(f"calls: {len(calls)} (cached {sum(c['cached'] for c in calls)})    "
+                 f"tokens: {tokens}    cost: ${spent:.4f}")
+
+    per_model = {}
+    for c in calls:
+        per_model.setdefault(c["model"], []).append(c)
+    lines.append("")
+    lines.append("per model:")
+    lines.append(f"  {'model':<36}{'calls':>7}{'prompt':>10}{'compl.':>10}{'cost $':>10}"
+                 f"{'p50 ms':>10}{'p95 ms':>10}{'ttfb ms':>10}")
+    for model, group in sorted(per_model.items(), key=lambda kv: -sum(c["total_tokens"] for c in kv[1])):
+        latencies = [c["latency_ms"] for c in group if c["latency_ms"] is not None and not c["cached"]]
+        ttfbs = [c["ttfb_ms"] for c in group if c["ttfb_ms"] is not None]
+        lines.append(
+            f"  {model[-36:]:<36}{len(group):>7}{sum(c['prompt_tokens'] for c in group):>10}"
+            f"{sum(c['completion_tokens'] for c in group):>10}{sum(c['cost'] or 0 for c in group):10.4f}"
+            f"{_fmt(_pct(latencies, 50))}{_fmt(_pct(latencies, 95))}"
+            f"{_fmt(sum(ttfbs) / len(ttfbs) if ttfbs else None)}"
+        )
+
+    per_prompt = {}
+    for c in calls:
+        stat = per_prompt.setdefault(c["prompt"], {"count": 0, "tokens": 0, "cost": 0.0})
+        stat["count"] += 1
+        stat["tokens"] += c["total_tokens"]
+        stat["cost"] += c["cost"] or 0
+    lines.append("")
+    lines.append(f"top {top} prompts by tokens:")
+    lines.append(f"  {'count':>6}{'tokens':>10}{'cost $':>10}  prompt")
+    for prompt, stat in sorted(per_prompt.items(), key=lambda kv: kv[1]["tokens"], reverse=True)[:top]:
+        preview = prompt.replace("\n", " ")[:60]
+        lines.append(f"  {stat['count']:>6}{stat['tokens']:>10}{stat['cost']:10.4f}  {preview}")
+
+    lines.append("")
+    lines.append(f"slowest {top} calls:")
+    lines.append(f"  {'latency':>10}{'ttfb':>10}{'tokens':>8}  {'endpoint':<28}prompt")
+    for c in sorted(calls, key=lambda c: c["latency_ms"] or 0, reverse=True)[:top]:
+        preview = c["prompt"].replace("\n", " ")[:40]
+        lines.append(f"  {_fmt(c['latency_ms'])}{_fmt(c['ttfb_ms'])}{c['total_tokens']:>8}  "
+                     f"{c['endpoint'][-28:]:<28}{preview}")
+    return "\n".join(lines)
+
+
+def tasks_report(redis, top=10):
+    lines = [f"top {top} tasks by tokens:",
+             f"  {'task_id':<34}{'calls':>7}{'prompt':>10}{'compl.':>10}{'cost $':>10}{'mean ms':>10}"]
+    for task_id, _ in redis.zrevrange("llm-usage-tasks", 0, top - 1, withscores=True):
+        total = redis.hgetall(f"llm-usage-total:{task_id}")
+        calls = int(total.get("calls", 0))
+        mean = float(total.get("latency_ms", 0)) / calls if calls else None
+        lines.append(
+            f"  {task_id[-34:]:<34}{calls:>7}{int(total.get('prompt_tokens', 0)):>10}"
+            f"{int(total.get('completion_tokens', 0)):>10}{float(total.get('cost', 0)):10.4f}{_fmt(mean)}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from core.Context import Context
+
+    parser = argparse.ArgumentParser(description="Report LLM token, latency and cost usage")
+    parser.add_argument("task_id", nargs="?")
+    parser.add_argument("--tasks", action="store_true", help="List the tasks that used the most tokens")
+    parser.add_argument("--top", type=int, default=10, help="Number of rows per section")
+    args = parser.parse_args()
+    if not args.tasks and not args.task_id:
+        parser.error("task_id is required unless --tasks is given")
+
+    with Context(task_id=args.task_id) as ctx:
+        if args.tasks:
+            print(tasks_report(ctx.redis, top=args.top))
+        else:
+            print(report(load(ctx.redis, args.task_id), top=args.top))
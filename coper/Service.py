@@ -1,23 +1,63 @@
-import json
 import uuid
 
-import pika
-
-from core.Computable import Computable
+from core.Computable import Computable, Parked
+from core.Graph import fail_node
+from core.Service import decode_response, encode_response, request_queue, route
 from core.Utils import serialize
 
 
 class Service(Computable):
-    """Invoke a remote service."""
+    """Invoke a remote service.
+
+    continuation=True 时不在 Runner 线程中等待响应：节点挂起为 WAITING_SERVICE，
+    Service 处理完成后直接写入节点结果并调度下游节点。
+
+    routing=True 时根据注册表把请求发给负载最低的存活副本，没有存活副本时立即抛出异常；
+    routing=False 时发布到共享队列，由任意副本（包括之后才启动的副本）处理。
+    """
 
-    def __init__(self, service_id):
-        super().__init__(service_id)
+    def __init__(self, service_id, continuation: bool = False, routing: bool = True):
+        super().__init__(service_id, continuation=continuation, routing=routing)
         self.service_id = service_id
+        self.continuation = continuation
+        self.routing = routing
+
+    def _target_queue(self):
+        return route(self.ctx, self.service_id) if self.routing else request_queue(self.service_id)
+
+    def _publish(self, request, queue):
+        # 在 Runner 的工作线程中执行，发布交给连接所在线程完成
+        self.ctx.send_mq_message(serialize(request)[0], queue=queue,
+                                 on_rejected=lambda error: self._rejected(request, error))
 
+    def _rejected(self, request, error):
+        """请求被队列拒绝（队列已满）：挂起的节点以 ERROR 结束，同步等待的调用方收到错误响应。"""
+        node = request.get("node")
+        if node:
+            fail_node(self.ctx, node["task_id"], node["exec_id"], error, queue=node["queue"])
+        else:
+            rv = {"status": "error", "message": str(error), "stack": ""}
+            self.redis.lpush(request["return_queue"], encode_response(self.ctx, rv, request["return_queue"]))
 
     def compute(self, *args, **kwargs) -> object:
         """Invoke the remote service with the provided arguments."""
 
+        # 在挂起节点之前选定副本，没有存活副本时节点直接失败
+        queue = self._target_queue()
+        if self.continuation:
+            request = {
+                'task_id': self.ctx.task,
+                'return_queue': None,
+                'args': args,
+                'kwargs': kwargs,
+            }
+
+            def dispatch(node):
+                request['node'] = node
+                self._publish(request, queue)
+
+            return Parked(dispatch)
+
         return_id = str(uuid.uuid4().hex)
         return_queue = f"service-response:{self.service_id}:{return_id}"
         request = {
@@ -26,21 +66,17 @@ class Service(Computable):
             'args': args,
             'kwargs': kwargs,
         }
-        # ``Computable`` does not provide a channel attribute. Use the channel
-        # from the current context to publish the request message.
-        channel = self.ctx.channel
-        channel.basic_publish(
-            exchange='',
-            routing_key=f"service.request.{self.service_id}",
-            body=serialize(request)[0],
-            properties=pika.BasicProperties(
-                delivery_mode=2
-            )
-        )
-
-        _, res = self.redis.blpop([return_queue])
+        self._publish(request, queue)
+
+        # 分段等待响应，以便在任务被取消时及时退出
+        while True:
+            item = self.redis.blpop([return_queue], timeout=5)
+            if item is not None:
+                break
+            self.ctx.check_cancelled()
+        _, res = item
         self.redis.delete(return_queue)
-        response = json.loads(res)
+        response = decode_response(self.ctx, res)
         if response['status'] == 'error':
             print(response["stack"])
             raise Exception(response['message'])
@@ -1,6 +1,7 @@
 import requests
 import os
 from core.Computable import Computable
+from core.RateLimiter import RateLimiter
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from coper.Minio import Minio
@@ -36,7 +37,11 @@ class TTSOutput(BaseModel):
 
 
 class TTS(Computable):
-    """Text-to-Speech conversion using MiniMax API."""
+    """Text-to-Speech conversion using MiniMax API.
+
+    调用前从共享令牌桶获取配额，限额由 MINIMAX_RPM / MINIMAX_TPM（按字符计）或
+    MINIMAX_{MODEL}_RPM 等环境变量配置（见 core.RateLimiter）。
+    """
 
     def __init__(self):
         super().__init__()
@@ -115,6 +120,8 @@ class TTS(Computable):
                 "language_boost": language_boost
             }
 
+            # MiniMax 按字符计费，TPM 按字符数预占
+            RateLimiter("MINIMAX", model).acquire(len(text))
             response = requests.post(url, headers=headers, json=payload)
             
             if response.status_code == 200:
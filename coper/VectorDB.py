@@ -1,18 +1,23 @@
-from pymilvus import (
-    FieldSchema, CollectionSchema, DataType,
-    Collection, utility
-)
 from typing import Optional
 from core.Computable import Computable
+from core.Context import get_context
 
 
 
 class VectorDBOperations:
+    """Milvus 操作集合。pymilvus 导入耗时较长，各方法在执行时才导入。"""
+
     def __init__(self):
         pass
 
+    @property
+    def using(self) -> str:
+        # 首次执行操作时才连接 Milvus
+        return get_context().milvus
+
     def create_collection(self, collection_name: str, dimension: int):
-        if utility.has_collection(collection_name, using="agent_vectorDB"):
+        from pymilvus import FieldSchema, CollectionSchema, DataType, Collection, utility
+        if utility.has_collection(collection_name, using=self.using):
             print(f"[WARNING] Collection '{collection_name}' 已存在，跳过创建")
             return
         id_field = FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True)
@@ -21,29 +26,34 @@ class VectorDBOperations:
         label_field = FieldSchema(name="label", dtype=DataType.VARCHAR, max_length=1024)
 
         schema = CollectionSchema(fields=[id_field, vec_field, content_field, label_field])
-        Collection(name=collection_name, schema=schema, using="agent_vectorDB")
+        Collection(name=collection_name, schema=schema, using=self.using)
         print(f"[INFO] Collection '{collection_name}' 创建成功，向量维度 = {dimension}")
 
     def drop_collection(self, collection_name: str):
-        if utility.has_collection(collection_name, using="agent_vectorDB"):
-            utility.drop_collection(collection_name, using="agent_vectorDB")
+        from pymilvus import utility
+        if utility.has_collection(collection_name, using=self.using):
+            utility.drop_collection(collection_name, using=self.using)
             print(f"[INFO] Collection '{collection_name}' 已删除")
         else:
             print(f"[WARNING] Collection '{collection_name}' 不存在，无法删除")
 
     def create_index(self, collection_name: str, index_params: Optional[dict] = None):
+        from pymilvus import Collection
         if index_params is None:
             index_params = {
                 "index_type": "IVF_FLAT",
                 "params": {"nlist": 128},
                 "metric_type": "L2"
             }
-        collection = Collection(name=collection_name, using="agent_vectorDB")
+        collection = Collection(name=collection_name, using=self.using)
         collection.create_index(field_name="embedding", index_params=index_params)
         print(f"[INFO] Collection '{collection_name}' 向量字段 'embedding' 已创建索引：{index_params}")
 
-    def insert_vector(self, collection_name: str, vectors: list, contents: list, labels: Optional[list] = None, partition_name: str = "_default"):
-        collection = Collection(name=collection_name, using="agent_vectorDB")
+    def insert_vector(self, collection_name: str, vectors: list, contents: list, labels: Optional[list] = None,
+                      partition_name: str = "_default", flush: bool = True):
+        """插入向量并返回 ID。flush=False 时不等待落盘（同步 flush 耗时数秒），插入的数据仍可被检索。"""
+        from pymilvus import Collection
+        collection = Collection(name=collection_name, using=self.using)
         if partition_name != "_default":
             if partition_name not in [p.name for p in collection.partitions]:
                 collection.create_partition(partition_name)
@@ -53,13 +63,15 @@ class VectorDBOperations:
         assert len(vectors) == len(labels), "向量和标签数量必须一致"
         assert len(vectors) == len(contents), "向量和内容数量必须一致"
         insert_result = collection.insert([vectors, contents, labels], partition_name=partition_name)
-        collection.flush()
+        if flush:
+            collection.flush()
         ids = insert_result.primary_keys
         print(f"[INFO] 插入 {len(vectors)} 条记录，ID 范围：{ids[0]} ~ {ids[-1]}，分区：{partition_name}")
         return list(ids)
 
     def search_vector(self, collection_name: str, query_vector: list, top_k: int = 3, partition_name: str = "_default", expr: Optional[str] = None):
-        collection = Collection(name=collection_name, using="agent_vectorDB")
+        from pymilvus import Collection
+        collection = Collection(name=collection_name, using=self.using)
         collection.load(partition_names=[partition_name])
         search_params = {"metric_type": "L2", "params": {"nprobe": 10}}
 
@@ -76,11 +88,19 @@ class VectorDBOperations:
         return [(hit.entity.get("id"), hit.entity.get("content"), hit.entity.get("label"), hit.distance) for hit in results[0]] # type: ignore
 
 
-    def delete_vector(self, collection_name: str, vector_id: int):
-        collection = Collection(name=collection_name, using="agent_vectorDB")
-        collection.delete(f"id in [{vector_id}]")
-        collection.flush()
-        print(f"[INFO] 已请求删除 ID = {vector_id} 的向量记录")
+    def delete_vector(self, collection_name: str, vector_id: int, flush: bool = True):
+        self.delete_vectors(collection_name, [vector_id], flush=flush)
+
+    def delete_vectors(self, collection_name: str, vector_ids: list, flush: bool = True):
+        """一次请求删除多条向量。"""
+        from pymilvus import Collection
+        if not vector_ids:
+            return
+        collection = Collection(name=collection_name, using=self.using)
+        collection.delete(f"id in [{', '.join(str(int(i)) for i in vector_ids)}]")
+        if flush:
+            collection.flush()
+        print(f"[INFO] 已请求删除 ID = {vector_ids} 的向量记录")
         
 
 class VectorDB(Computable):
@@ -1,3 +1,6 @@
+import functools
+import operator
+
 from core.Computable import Computable
 from pydantic import BaseModel, Field
 
@@ -11,6 +14,10 @@ class BinaryInput(BaseModel):
     y: object = Field(..., description="second operand")
 
 
+class VariadicInput(BaseModel):
+    xs: list = Field(..., description="operands, passed positionally")
+
+
 class BasicOutput(BaseModel):
     result: object = Field(..., description="operation result")
 
@@ -47,6 +54,15 @@ class Mul(Multiply):
     pass
 
 
+class Sum(Computable):
+    input_schema = VariadicInput
+    output_schema = BasicOutput
+    description = "Return xs[0] + xs[1] + ... (suitable for Computable.reduce)"
+
+    def compute(self, *xs):
+        return functools.reduce(operator.add, xs)
+
+
 class Divide(Computable):
     input_schema = BinaryInput
     output_schema = BasicOutput
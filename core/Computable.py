@@ -1,6 +1,23 @@
-from core.ComputableResult import ComputableResult
-from core.Context import get_context
+import time
+
+from core.ComputableResult import ComputableResult, ComputableResultList
+from core.Context import QueueFullError, QuotaExceededError, get_context
+from core.Graph import fail_node
 from core.Utils import serialize
+from core import trace
+
+
+class Parked:
+    """
+    ``compute`` 返回 Parked 表示节点的结果将由外部（如 continuation 模式的 Service）写入。
+
+    Runner 先把节点由 RUNNING 原子地转为 WAITING_SERVICE，再调用 ``dispatch(node)`` 派发请求，
+    随后立即确认消息并释放线程；外部通过 finish_task 完成节点（见 ``core.Graph.finish_node``）。
+    ``node`` 为 ``{"task_id", "exec_id", "queue"}``，queue 是完成后子任务应发布到的 Runner 队列。
+    """
+
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
 
 
 class Computable:
@@ -20,6 +37,10 @@ class Computable:
     #: Human readable description of the computable's capability.
     description = ""
 
+    #: Whether running the same node twice is harmless. Only idempotent
+    #: operators are eligible for hedged (speculative) re-execution.
+    idempotent = False
+
     def __init__(self, *args, **kwargs):
         self.ctx = get_context()
         self.redis = self.ctx.redis
@@ -31,52 +52,158 @@ class Computable:
         self.output_schema = getattr(self.__class__, 'output_schema', None)
 
     def __call__(self, *args, **kwargs):
-        task_id = self.ctx.task
-        task_key = f"runner-node:{task_id}"
-        task_waiter_key = f"runner-node-waiters:{task_id}"
-
-        # 原子自增 exec_id
-        exec_id = self.redis.incr(f"runner-node-counter:{task_id}")
-
-        dep_list = []
-
-        def find_dep(obj):
-            if isinstance(obj, ComputableResult):
-                dep_list.append(obj.exec_id)
-            elif isinstance(obj, list) or isinstance(obj, tuple):
-                for item in obj:
-                    find_dep(item)
-            elif isinstance(obj, dict):
-                for k, v in obj.items():
-                    find_dep(k)
-                    find_dep(v)
-            return None
-
-        find_dep(args)
-        find_dep(kwargs)
-
-        job = {
-            "exec_id": exec_id,
-            "task_id": task_id,
-            "task": f"{self.__class__.__module__}.{self.__class__.__name__}",
-            "args": args,
-            "kwargs": kwargs,
-            "init_args": self.init_args,
-            "init_kwargs": self.init_kwargs,
-        }
-
-        dep = ",".join(str(dep) for dep in dep_list)
-        ser_bin_job, ser_str_job = serialize(job)
-
-        # 原子写入状态、依赖、job
-        dep_cnt = self.ctx.init_task(keys=[task_key, task_waiter_key], args=[exec_id, ser_str_job, dep])
+        return self._submit([(args, kwargs)])[0]
+
+    def map(self, iterable, **common_kwargs):
+        """对 iterable 中的每个元素批量提交一次计算。
+
+        每个元素作为唯一的位置参数，``common_kwargs`` 作为所有节点共享的关键字参数。
+        与 ``[op(x) for x in iterable]`` 相比，只需一次 INCRBY 分配连续的 exec_id、
+        一次脚本调用注册全部节点，并批量发布到 RabbitMQ。
+
+        Returns:
+            ComputableResultList: 与输入顺序一致的结果句柄列表，可直接作为其他算子的参数，
+            或通过 ``gather`` / ``.result()`` 获取全部结果。
+        """
+        calls = [((item,), common_kwargs) for item in iterable]
+        return ComputableResultList(self._submit(calls))
+
+    @staticmethod
+    def reduce(results, op, arity=2):
+        """以平衡 k 叉树的方式聚合一组结果。
+
+        每一层把相邻的 ``arity`` 个结果作为位置参数交给 ``op``（一次批量提交），
+        不足一组的尾部直接进入下一层。每个节点最多只有 ``arity`` 个依赖，
+        叶子完成后对应的部分聚合即可开始，不会出现持有上千个依赖的汇聚节点。
+
+        Args:
+            results: 待聚合的 ComputableResult（或普通值）序列。
+            op: 算子实例，其 ``compute`` 需接受 ``arity`` 个位置参数并满足结合律。
+            arity: 树的分叉数，至少为 2。
+
+        Returns:
+            ComputableResult: 根节点的结果句柄（只有一个输入时原样返回）。
+        """
+        if arity < 2:
+            raise ValueError("arity must be at least 2")
+        level = list(results)
+        if not level:
+            raise ValueError("reduce() of empty sequence")
+
+        while len(level) > 1:
+            chunks = [level[i:i + arity] for i in range(0, len(level), arity)]
+            calls = [(tuple(chunk), {}) for chunk in chunks if len(chunk) > 1]
+            reduced = iter(op._submit(calls))
+            level = [next(reduced) if len(chunk) > 1 else chunk[0] for chunk in chunks]
+
+        return level[0]
+
+    def _submit(self, calls):
+        """批量注册并发布节点，calls 为 (args, kwargs) 列表，返回对应的 ComputableResult 列表。"""
+        if not calls:
+            return []
 
-        # 依赖为 0 时，直接发布到 RabbitMQ
-        if dep_cnt == 0:
-            self.ctx.send_mq_message_now(ser_bin_job)
+        task_id = self.ctx.task
 
-        return ComputableResult(exec_id)
+        submitted_at = trace.now_ms()
+
+        # 原子自增 exec_id，一次分配连续区间
+        last_exec_id = self.redis.incrby(f"runner-node-counter:{task_id}", len(calls))
+        first_exec_id = last_exec_id - len(calls) + 1
+
+        script_args = []
+        bin_jobs = []
+        for exec_id, (args, kwargs) in enumerate(calls, start=first_exec_id):
+            dep_list = []
+            dep_seen = set()
+
+            def find_dep(obj):
+                if isinstance(obj, ComputableResult):
+                    # 同一依赖只登记一次，否则 dep_cnt 会多计而永远无法归零
+                    if obj.exec_id not in dep_seen:
+                        dep_seen.add(obj.exec_id)
+                        dep_list.append(obj.exec_id)
+                elif isinstance(obj, list) or isinstance(obj, tuple):
+                    for item in obj:
+                        find_dep(item)
+                elif isinstance(obj, dict):
+                    for k, v in obj.items():
+                        find_dep(k)
+                        find_dep(v)
+                return None
+
+            find_dep(args)
+            find_dep(kwargs)
+
+            job = {
+                "exec_id": exec_id,
+                "task_id": task_id,
+                "task": f"{self.__class__.__module__}.{self.__class__.__name__}",
+                "args": args,
+                "kwargs": kwargs,
+                "init_args": self.init_args,
+                "init_kwargs": self.init_kwargs,
+            }
+
+            dep = ",".join(str(dep) for dep in dep_list)
+            ser_bin_job, ser_str_job = serialize(job)
+            script_args.extend([exec_id, ser_str_job, dep])
+            bin_jobs.append(ser_bin_job)
 
+        # 原子写入状态、依赖、job
+        dep_cnt_list = self._init_nodes(task_id, script_args, len(calls))
+
+        # 依赖为 0 的节点，直接批量发布到 RabbitMQ（已取消的节点 dep_cnt 为 -1，不发布）
+        ready = [(exec_id, bin_job) for exec_id, bin_job, dep_cnt
+                 in zip(range(first_exec_id, last_exec_id + 1), bin_jobs, dep_cnt_list) if int(dep_cnt) == 0]
+        if ready:
+            try:
+                self.ctx.send_mq_messages_now([bin_job for _, bin_job in ready])
+            except QueueFullError as e:
+                # 节点已注册并计入配额：未发布的节点以 ERROR 结束，释放配额并取消其下游
+                for exec_id, _ in ready[len(ready) - len(e.unpublished):]:
+                    fail_node(self.ctx, task_id, exec_id, e)
+                raise
+
+        if self.ctx.trace:
+            ready_at = trace.now_ms()
+            pipe = self.redis.pipeline(transaction=False)
+            for exec_id, dep_cnt in enumerate(dep_cnt_list, start=first_exec_id):
+                if int(dep_cnt) == 0:
+                    trace.record(pipe, task_id, exec_id, submitted=submitted_at, ready=ready_at)
+                else:
+                    trace.record(pipe, task_id, exec_id, submitted=submitted_at)
+            pipe.execute()
+
+        return [ComputableResult(exec_id) for exec_id in range(first_exec_id, last_exec_id + 1)]
+
+    def _init_nodes(self, task_id, script_args, count):
+        """
+        通过 init_task 注册节点。注册后未结束的节点数会超过配额时，
+        按 ctx.backpressure 等待已有节点完成后重试，或抛出 QuotaExceededError。
+        """
+        keys = [
+            f"runner-node:{task_id}", f"runner-node-waiters:{task_id}", f"runner-node-result:{task_id}",
+            f"runner-task-quota:{task_id}", "runner-task-quota",
+        ]
+        args = [self.ctx.max_in_flight, *script_args]
+        deadline = None
+        delay = 0.01
+        while True:
+            rv = self.ctx.init_task(keys=keys, args=args)
+            if not rv or rv[0] != "QUOTA":
+                return rv
+            _, active, quota = rv
+            message = f"Task {task_id} has {active} nodes in flight, submitting {count} more exceeds quota {quota}"
+            if self.ctx.backpressure == "raise" or count > int(quota):
+                raise QuotaExceededError(message)
+            if deadline is None:
+                deadline = time.monotonic() + self.ctx.backpressure_timeout
+            elif time.monotonic() > deadline:
+                raise QuotaExceededError(f"{message} (waited {self.ctx.backpressure_timeout}s)")
+            self.ctx.check_cancelled(task_id)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
 
     def compute(self, *args, **kwargs):
         raise NotImplementedError("compute must return a value or raise")
@@ -1,4 +1,6 @@
 import json
+import math
+import time
 from core.Context import get_context
 from core.Utils import deserialize
 
@@ -27,11 +29,25 @@ class ComputableResult:
         self.exec_id = exec_id
         self.ctx = get_context()
 
-    def result(self):
+    def result(self, timeout=None):
+        """
+        阻塞获取结果；节点失败或被取消时抛出异常。
+        timeout 为最长等待秒数（必须为正数），超时抛出 TimeoutError；None 表示一直等待。
+        旧版本 Redis 的 BLPOP 只接受整数秒，小数向上取整。
+        """
+        if timeout is None:
+            block = 0
+        elif timeout <= 0:
+            raise ValueError(f"timeout must be positive or None, got {timeout}")
+        else:
+            block = math.ceil(timeout)
         task_id = self.ctx.task
         r = self.ctx.redis
         res_list_name = f"runner-node-result:{task_id}:{self.exec_id}"
-        _, res = r.blpop([res_list_name])
+        item = r.blpop([res_list_name], timeout=block)
+        if item is None:
+            raise TimeoutError(f"Result {self.exec_id} of task {task_id} not ready after {timeout}s")
+        _, res = item
         r.rpush(res_list_name, res)
 
         res = deserialize(res)
@@ -185,6 +201,38 @@ class ComputableResult:
         raise TypeError("Cannot use ComputableResult in boolean context")
 
 
+class ComputableResultList(list):
+    """
+    批量提交（如 ``Computable.map``）返回的结果句柄列表。
+    本身就是 list，可以直接作为其他算子的参数传入；``.result()`` 等价于 ``gather(self)``。
+    """
+
+    def result(self, timeout=None):
+        return gather(self, timeout=timeout)
+
+    def __repr__(self):
+        return f"<ResultList size={len(self)}>"
+
+
+def gather(results, timeout=None):
+    """
+    按顺序阻塞获取一组 ComputableResult 的结果，任一节点失败则抛出异常。
+    timeout 为整体的最长等待秒数（必须为正数），超时抛出 TimeoutError。
+    """
+    if timeout is None:
+        return [r.result() for r in results]
+    if timeout <= 0:
+        raise ValueError(f"timeout must be positive or None, got {timeout}")
+    deadline = time.monotonic() + timeout
+    values = []
+    for r in results:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"gather() not finished after {timeout}s")
+        values.append(r.result(timeout=remaining))
+    return values
+
+
 # 将逻辑方法绑定到 ComputableResult
 ComputableResult.logical_not = logical_not
 ComputableResult.logical_and = logical_and
@@ -1,57 +1,106 @@
 import functools
 import os
+import threading
+import time
 import urllib.parse
+from typing import TYPE_CHECKING
 
-from pika.exceptions import AMQPConnectionError
-from pymilvus import connections
+from pika.exceptions import AMQPConnectionError, NackError
 import redis
 import pika
 import contextvars
 from dotenv import load_dotenv
-from minio import Minio
+
+if TYPE_CHECKING:
+    from minio import Minio
+
+# pymilvus / minio 导入耗时较长，只在首次使用对应后端时导入
 
 # Global ContextVar for storing the current execution context
 _current_ctx = contextvars.ContextVar("current_execution_context")
 
+#: VectorDB 使用的 Milvus 连接别名
+MILVUS_ALIAS = "agent_vectorDB"
+
+_milvus_lock = threading.Lock()
+_milvus_connected = False
+
+
+@functools.lru_cache(maxsize=None)
+def _load_env():
+    """每个进程只读取一次 middleware/.env。"""
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv(dotenv_path=os.path.join(base_dir, 'middleware', '.env'))
+
+
+def _connect_milvus(host, port):
+    """每个进程只建立一次 Milvus 连接。"""
+    global _milvus_connected
+    with _milvus_lock:
+        if not _milvus_connected:
+            from pymilvus import connections
+            connections.connect(alias=MILVUS_ALIAS, host=host, port=port)
+            _milvus_connected = True
+
+
+class CancelledError(Exception):
+    """Raised by operators that observe the cancel flag of their task."""
+
+
+class QuotaExceededError(Exception):
+    """Raised when a submission would exceed the task's in-flight quota."""
+
+
+class QueueFullError(Exception):
+    """Raised when RabbitMQ rejects a publish because the queue reached its length limit.
+
+    ``unpublished`` holds the messages that were not published, starting with the rejected one.
+    """
+
+    def __init__(self, message, unpublished=()):
+        super().__init__(message)
+        self.unpublished = list(unpublished)
+
+
+def queue_arguments():
+    """
+    声明 Runner / Service 请求队列时使用的长度限制参数。
+    MQ_QUEUE_MAX_LENGTH 为队列最多保留的消息数（默认不限制），MQ_QUEUE_OVERFLOW 为超出后的策略
+    （默认 reject-publish：拒绝新消息，发布方收到 QueueFullError）。
+    注意 RabbitMQ 不允许用不同的参数重新声明已存在的队列，已有队列需要删除后重建或改用 policy。
+    """
+    max_length = int(os.getenv("MQ_QUEUE_MAX_LENGTH", "0"))
+    if not max_length:
+        return None
+    return {"x-max-length": max_length, "x-overflow": os.getenv("MQ_QUEUE_OVERFLOW", "reject-publish")}
+
 
 class Context:
     """
-    Manages Redis and RabbitMQ connections.
-    Establishes connections when entering the context and closes RabbitMQ connection on exit,
-    resetting the global ContextVar.
+    Manages Redis, RabbitMQ, MinIO and Milvus connections.
+    Each backend is connected lazily on first use inside the context; the RabbitMQ
+    connection is closed on exit and the global ContextVar is reset.
+
+    max_in_flight 限制当前任务未结束的节点数（默认读取 TASK_MAX_IN_FLIGHT，0 表示不限制）；
+    Redis 中的 runner-task-quota:{task_id} / runner-task-quota 可以为单个任务 / 所有任务设置配额。
+    超出时 backpressure="block" 的提交会等待节点完成（最多 backpressure_timeout 秒），
+    "raise" 则立即抛出 QuotaExceededError。
     """
 
-    def __init__(self, task_id=None, router: str = ""):
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        env_path = os.path.join(base_dir, 'middleware', '.env')
-        load_dotenv(dotenv_path=env_path)
+    def __init__(self, task_id=None, router: str = "", trace: bool | None = None,
+                 max_in_flight: int | None = None, backpressure: str | None = None):
+        _load_env()
         header_address = os.getenv("HEADER_ADDRESS")
         redis_port = os.getenv("REDIS_PORT")
-        redis_pass = urllib.parse.quote(os.getenv("REDIS_PASSWORD"), safe='')
-        rabbitmq_port = os.getenv("RABBITMQ_PORT")
-        rabbitmq_user = os.getenv("RABBITMQ_USER")
-        rabbitmq_pass = os.getenv("RABBITMQ_PASSWORD")
+        redis_pass = urllib.parse.quote(os.getenv("REDIS_PASSWORD", ""), safe='')
         minio_port = os.getenv("MINIO_API_PORT")
-        minio_user = os.getenv("MINIO_ROOT_USER")
-        minio_pass = os.getenv("MINIO_ROOT_PASSWORD")
-        # Connect to Milvus VectorDB
-        connections.connect(
-            alias="agent_vectorDB",
-            host=os.getenv("HEADER_ADDRESS"),
-            port=os.getenv("MILVUS_PORT")
-        )
         self.redis_url = f"redis://:{redis_pass}@{header_address}:{redis_port}/1"
-        credentials = pika.PlainCredentials(
-            username=rabbitmq_user,
-            password=rabbitmq_pass,
-        )
-        self.amqp_para = pika.ConnectionParameters(
-            host=header_address,
-            port=int(rabbitmq_port),
-            heartbeat=60,
-            virtual_host="/",
-            credentials=credentials,
-        )
+        self.amqp_host = header_address
+        self.amqp_port = os.getenv("RABBITMQ_PORT")
+        self.amqp_user = os.getenv("RABBITMQ_USER")
+        self.amqp_pass = os.getenv("RABBITMQ_PASSWORD")
+        self.milvus_host = header_address
+        self.milvus_port = os.getenv("MILVUS_PORT")
         self.router = router
         self.queue = f"runner_task_queue_{router}" if router else "runner_task_queue"
         self._redis = None
@@ -59,33 +108,83 @@ class Context:
         self._channel = None
         self._minio = None
         self._token = None
-        self.task_id = task_id
-        self.init_task = None
+        self._entered = False
+        self._lock = threading.RLock()
+        self._scripts = {}
+        # 当前任务 ID 保存在 ContextVar 中：Runner / Service 的并发处理线程各自运行在
+        # 复制出的 contextvars 上下文里，set_task 互不覆盖。
+        # 未通过 copy_context 启动的线程（如算子自行创建的 threading.Thread）看不到 ContextVar，
+        # 回退到实例上最近一次设置的任务 ID（与引入 ContextVar 之前的行为一致）
+        self._task_var = contextvars.ContextVar(f"task_id:{id(self)}")
+        self._task_id = task_id
+        # 是否记录节点耗时账本（见 core.trace），默认开启，可通过 RUNNER_TRACE=0 关闭
+        self.trace = trace if trace is not None else os.getenv("RUNNER_TRACE", "1") != "0"
+        # 提交方背压（见 Computable._submit 与 init_task.lua）
+        self.max_in_flight = max_in_flight if max_in_flight is not None else int(os.getenv("TASK_MAX_IN_FLIGHT", "0"))
+        self.backpressure = backpressure or os.getenv("TASK_BACKPRESSURE", "block")
+        self.backpressure_timeout = float(os.getenv("TASK_BACKPRESSURE_TIMEOUT", "300"))
+        if self.backpressure not in ("block", "raise"):
+            raise ValueError(f"backpressure must be 'block' or 'raise', got {self.backpressure!r}")
 
         self.minio_endpoint = f"{header_address}:{minio_port}"
-        self.minio_user = minio_user
-        self.minio_pass = minio_pass
+        self.minio_user = os.getenv("MINIO_ROOT_USER")
+        self.minio_pass = os.getenv("MINIO_ROOT_PASSWORD")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _read_lua(name):
+        """读取脚本，并把 "-- #include <file>" 行展开为对应文件的内容（EVAL 不支持引用其他脚本）。"""
+        lua_path = os.path.join(os.path.dirname(__file__), name)
+        with open(lua_path, 'r', encoding="utf8") as _f:
+            lines = _f.read().splitlines(keepends=True)
+        return "".join(
+            Context._read_lua(line.split()[-1]) if line.startswith("-- #include ") else line for line in lines
+        )
 
-        init_task_lua_path = os.path.join(os.path.dirname(__file__), "init_task.lua")
-        with open(init_task_lua_path, 'r', encoding="utf8") as _f:
-            self._init_task_lua = _f.read()
+    @property
+    def amqp_para(self) -> pika.ConnectionParameters:
+        return pika.ConnectionParameters(
+            host=self.amqp_host,
+            port=int(self.amqp_port),
+            heartbeat=60,
+            virtual_host="/",
+            credentials=pika.PlainCredentials(username=self.amqp_user, password=self.amqp_pass),
+        )
 
     def mq_connect(self):
-        self._connection = pika.BlockingConnection(self.amqp_para)
-        self._channel = self._connection.channel()
-        self._channel.basic_qos(prefetch_count=1)
-        self._channel.queue_declare(queue=self.queue, durable=True)
+        with self._lock:
+            self._connection = pika.BlockingConnection(self.amqp_para)
+            self._channel = self._connection.channel()
+            self._channel.basic_qos(prefetch_count=1)
+            arguments = queue_arguments()
+            self._channel.queue_declare(queue=self.queue, durable=True, arguments=arguments)
+            if arguments:
+                # 队列有长度限制时开启发布确认，被拒绝的消息以 QueueFullError 报告而不是静默丢弃
+                self._channel.confirm_delivery()
 
     def mq_reconnect(self):
-        if self._connection is None or self._connection.is_closed:
-            self.mq_connect()
+        with self._lock:
+            if self._connection is None or self._connection.is_closed:
+                self.mq_connect()
 
-    def send_mq_message_now(self, message):
+    def send_mq_message_now(self, message, queue=None):
+        self.send_mq_messages_now([message], queue=queue)
+
+    def send_mq_messages_now(self, messages, queue=None):
+        """
+        批量发布消息，重连后从第一条未发布成功的消息继续。
+        queue 为目标队列，默认是当前 router 的任务队列。
+        """
+        pending = list(messages)
         retry = 3
         while retry > 0:
             try:
-                self.__send_mq_message(message)
+                while pending:
+                    self.__send_mq_message(pending[0], queue)
+                    pending.pop(0)
                 break
+            except NackError:
+                raise QueueFullError(f"Queue {queue or self.queue} is full", pending)
             except AMQPConnectionError:
                 retry -= 1
                 self.mq_reconnect()
@@ -93,10 +192,28 @@ class Context:
                     raise AMQPConnectionError("Failed to publish message after retries")
 
 
-    def send_mq_message(self, message):
-        cb = functools.partial(self.__send_mq_message, message)
+    def send_mq_message(self, message, queue=None, on_rejected=None):
+        """
+        线程安全地发布消息（在连接所在线程执行），queue 默认是当前 router 的任务队列。
+        队列已满、消息被拒绝时在连接线程中调用 on_rejected(QueueFullError)，未提供时只打印警告。
+        """
+        cb = functools.partial(self.__publish_or_reject, message, queue, on_rejected)
         self.__add_callback(cb)
 
+    def __publish_or_reject(self, message, queue, on_rejected):
+        # 在 pika 的 I/O 循环中执行：NackError 不能抛出，否则会中断 start_consuming
+        try:
+            self.__send_mq_message(message, queue)
+        except NackError:
+            error = QueueFullError(f"Queue {queue or self.queue} is full", [message])
+            if on_rejected is None:
+                print(f"[WARNING] {error}, message dropped")
+                return
+            try:
+                on_rejected(error)
+            except Exception as e:
+                print(f"[WARNING] Failed to handle rejected message: {e}")
+
     def ack_mq_message(self, delivery_tag):
         # functools.partial 用于创建一个已预设部分参数的函数
         cb = functools.partial(self.__ack, delivery_tag)
@@ -106,7 +223,7 @@ class Context:
         retry = 3
         while retry > 0:
             try:
-                self._connection.add_callback_threadsafe(cb)
+                self.connection.add_callback_threadsafe(cb)
                 break
             except AMQPConnectionError:
                 retry -= 1
@@ -115,29 +232,20 @@ class Context:
                     raise AMQPConnectionError("Failed to publish message after retries")
 
     def __ack(self, delivery_tag):
-        self._channel.basic_ack(delivery_tag=delivery_tag)
+        self.channel.basic_ack(delivery_tag=delivery_tag)
 
-    def __send_mq_message(self, message):
-        self._channel.basic_publish(
+    def __send_mq_message(self, message, queue=None):
+        self.channel.basic_publish(
             exchange='',
-            routing_key=self.queue,
+            routing_key=queue or self.queue,
             body=message,
-            properties=pika.BasicProperties(delivery_mode=2)
+            # ready_at 为发布时刻（毫秒），消费端据此统计排队耗时
+            properties=pika.BasicProperties(delivery_mode=2, headers={"ready_at": int(time.time() * 1000)})
         )
 
     def __enter__(self):
-        # Establish Redis connection
-        self._redis = redis.Redis.from_url(self.redis_url, decode_responses=True)
-        self.init_task = self.redis.register_script(self._init_task_lua)
-        # Establish RabbitMQ connection and channel
-        self.mq_connect()
-        # Establish Minio client
-        self._minio = Minio(
-            self.minio_endpoint,
-            access_key=self.minio_user,
-            secret_key=self.minio_pass,
-            secure=False,
-        )
+        # Redis、RabbitMQ、MinIO、Milvus 均在首次使用时连接
+        self._entered = True
 
         # Set this context as the current one
         self._token = _current_ctx.set(self)
@@ -146,36 +254,104 @@ class Context:
     def __exit__(self, exc_type, exc_val, exc_tb):
         # Reset ContextVar
         _current_ctx.reset(self._token)
+        self._entered = False
         # Close RabbitMQ connection
         if self._connection and not self._connection.is_closed:
             self._connection.close()
+        self._connection = None
+        self._channel = None
         # Redis client manages connection pool automatically
         self._minio = None
 
+    def _require_entered(self, what):
+        if not self._entered:
+            raise RuntimeError(f"{what} is not initialized. Use within an ExecutionContext.")
+
     @property
     def redis(self) -> redis.Redis:
         if not self._redis:
-            raise RuntimeError("Redis is not initialized. Use within an ExecutionContext.")
+            self._require_entered("Redis")
+            with self._lock:
+                if not self._redis:
+                    self._redis = redis.Redis.from_url(self.redis_url, decode_responses=True)
         return self._redis
 
+    def _script(self, name):
+        # register_script 只计算 SHA，首次调用时才通过 EVALSHA / SCRIPT LOAD 访问服务器
+        script = self._scripts.get(name)
+        if script is None:
+            script = self._scripts[name] = self.redis.register_script(self._read_lua(f"{name}.lua"))
+        return script
+
+    @property
+    def init_task(self):
+        return self._script("init_task")
+
+    @property
+    def claim_task(self):
+        return self._script("claim_task")
+
+    @property
+    def finish_task(self):
+        return self._script("finish_task")
+
+    @property
+    def cancel_task(self):
+        return self._script("cancel_task")
+
+    @property
+    def park_task(self):
+        return self._script("park_task")
+
+    @property
+    def route_service(self):
+        return self._script("route_service")
+
+    @property
+    def rate_limit(self):
+        return self._script("rate_limit")
+
     @property
     def channel(self) -> pika.adapters.blocking_connection.BlockingChannel:
         if not self._channel:
-            raise RuntimeError("RabbitMQ channel is not initialized. Use within an ExecutionContext.")
+            self._require_entered("RabbitMQ channel")
+            self.mq_reconnect()
         return self._channel
 
     @property
     def connection(self) -> pika.BlockingConnection:
         if not self._connection:
-            raise RuntimeError("RabbitMQ connection is not initialized. Use within an ExecutionContext.")
+            self._require_entered("RabbitMQ connection")
+            self.mq_reconnect()
         return self._connection
 
     @property
-    def minio(self) -> Minio:
+    def minio(self) -> "Minio":
         if not self._minio:
-            raise RuntimeError("Minio client is not initialized. Use within an ExecutionContext.")
+            self._require_entered("Minio client")
+            from minio import Minio
+            self._minio = Minio(
+                self.minio_endpoint,
+                access_key=self.minio_user,
+                secret_key=self.minio_pass,
+                secure=False,
+            )
         return self._minio
 
+    @property
+    def milvus(self) -> str:
+        """Milvus 连接别名（供 ``using=`` 参数使用），首次访问时建立连接。"""
+        _connect_milvus(self.milvus_host, self.milvus_port)
+        return MILVUS_ALIAS
+
+    @property
+    def task_id(self):
+        return self._task_var.get(self._task_id)
+
+    @task_id.setter
+    def task_id(self, task_id):
+        self.set_task(task_id)
+
     @property
     def task(self):
         if self.task_id is None:
@@ -183,7 +359,37 @@ class Context:
         return self.task_id
 
     def set_task(self, task_id):
-        self.task_id = task_id
+        """设置当前线程（contextvars 上下文）中的任务 ID，同时作为未复制上下文的线程的回退值。"""
+        self._task_var.set(task_id)
+        self._task_id = task_id
+
+    def cancel(self, task_id=None, reason="Task cancelled"):
+        """
+        取消任务：尚未运行的节点立即标记为 CANCELLED 且不再发布，之后提交的节点直接取消；
+        正在运行的节点通过 ``is_cancelled`` / ``check_cancelled`` 协作退出。
+        返回本次被取消的节点数。
+        """
+        from core.Utils import serialize
+        task_id = task_id if task_id is not None else self.task
+        payload = serialize({"error": reason, "stack": ""})[1]
+        return self.cancel_task(
+            keys=[f"runner-node:{task_id}", f"runner-node-waiters:{task_id}", f"runner-node-result:{task_id}"],
+            args=[payload],
+        )
+
+    def is_cancelled(self, task_id=None):
+        task_id = task_id if task_id is not None else self.task
+        return bool(self.redis.hexists(f"runner-node:{task_id}", "cancelled"))
+
+    def in_flight(self, task_id=None):
+        """任务当前未结束（PENDING / RUNNING / WAITING_SERVICE）的节点数。"""
+        task_id = task_id if task_id is not None else self.task
+        return int(self.redis.hget(f"runner-node:{task_id}", "active") or 0)
+
+    def check_cancelled(self, task_id=None):
+        """在长时间运行的算子中周期性调用，任务被取消时抛出 CancelledError。"""
+        if self.is_cancelled(task_id):
+            raise CancelledError(f"Task {task_id if task_id is not None else self.task} cancelled")
 
 
 def get_context() -> Context:
@@ -0,0 +1,46 @@
+"""
+任务图的节点完成逻辑，供 Runner 与 continuation 模式的 Service 共用。
+
+单独成模块是为了让 core.Service 等模块不必导入 core.Runner：core.Runner 以 ``python -m core.Runner``
+启动时是 __main__，再导入一次会重新执行整个文件，其中的指标会重复注册。
+"""
+import functools
+
+from core import Metrics, trace
+from core.Utils import serialize
+
+
+def fail_node(ctx, task_id, exec_id, error, queue=None):
+    """以 ERROR 结束节点（下游节点随之取消），用于已注册但无法发布的节点。"""
+    return finish_node(ctx, task_id, exec_id, "ERROR", serialize({"error": str(error), "stack": ""})[1], queue)
+
+
+def finish_node(ctx, task_id, exec_id, state, result, queue=None):
+    """
+    原子地写入结果并调度依赖已满足的子任务，子任务发布到 queue（默认当前 router 的队列）。
+    节点已被其他副本完成时丢弃本次结果并返回 False。
+    """
+    with Metrics.REDIS_RTT.time(op="finish_task"):
+        ready = ctx.finish_task(
+            keys=[f"runner-node:{task_id}", f"runner-node-waiters:{task_id}", f"runner-node-result:{task_id}"],
+            args=[exec_id, state, result],
+        )
+    if not int(ready[0]):
+        print(f"任务 {exec_id} 已由其他副本完成，丢弃本次结果")
+        return False
+    children = list(zip(ready[1::2], ready[2::2]))
+    for cid, child_job in children:
+        # 子任务被队列拒绝时以 ERROR 结束，避免节点一直停留在 PENDING
+        on_rejected = functools.partial(_reject_child, ctx, task_id, cid, queue)
+        ctx.send_mq_message(child_job.encode('latin1'), queue=queue, on_rejected=on_rejected)
+    if ctx.trace and children:
+        ready_at = trace.now_ms()
+        pipe = ctx.redis.pipeline(transaction=False)
+        for cid, _ in children:
+            trace.record(pipe, task_id, cid, ready=ready_at)
+        pipe.execute()
+    return True
+
+
+def _reject_child(ctx, task_id, exec_id, queue, error):
+    fail_node(ctx, task_id, exec_id, error, queue)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class LatencyTracker:
+    """
+    按算子类记录最近的执行耗时，用于计算分位数。
+    redis data structure:
+        list: runner-latency:{task} float (最近 window 次成功执行的耗时，单位秒)
+    所有 Runner 共享同一份样本，读取时在进程内缓存 refresh 秒。
+    """
+
+    def __init__(self, redis, window=512, refresh=10.0):
+        self.redis = redis
+        self.window = window
+        self.refresh = refresh
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(task):
+        return f"runner-latency:{task}"
+
+    def record(self, task, seconds):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(self.key(task), f"{seconds:.6f}")
+        pipe.ltrim(self.key(task), 0, self.window - 1)
+        pipe.execute()
+
+    def samples(self, task):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(task)
+            if cached and now - cached[0] < self.refresh:
+                return cached[1]
+        samples = sorted(float(v) for v in self.redis.lrange(self.key(task), 0, -1))
+        with self._lock:
+            self._cache[task] = (now, samples)
+        return samples
+
+    def percentile(self, task, q):
+        samples = self.samples(task)
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(len(samples) * q / 100))
+        return samples[idx]
+
+
+class HedgePolicy:
+    """
+    对冲（推测执行）策略：标记为 ``idempotent = True`` 的节点运行时间超过
+    同类算子历史耗时的 ``percentile`` 分位数（乘以 ``multiplier``，且不小于 ``min_delay``）后，
+    再派发一个副本，先完成者生效。
+
+    样本不足 ``min_samples`` 时不对冲，避免冷启动阶段误判。
+    """
+
+    def __init__(self, tracker: LatencyTracker, percentile=95, multiplier=1.0, min_delay=1.0, min_samples=20):
+        self.tracker = tracker
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+    def threshold(self, task):
+        """返回该算子类的对冲等待时间（秒），无法判断时返回 None。"""
+        if len(self.tracker.samples(task)) < self.min_samples:
+            return None
+        p = self.tracker.percentile(task, self.percentile)
+        return max(self.min_delay, p * self.multiplier)
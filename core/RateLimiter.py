@@ -0,0 +1,118 @@
+import asyncio
+import os
+import re
+import time
+
+from core import Metrics
+from core.Context import get_context
+
+WAIT = Metrics.Histogram("rate_limit_wait_seconds", "Time spent waiting for a provider rate limit", ["provider"])
+THROTTLED = Metrics.Counter("rate_limit_throttled_total", "Calls that had to wait for a rate limit", ["provider"])
+
+#: 单次等待的最长时间，之后重新检查（期间可以响应任务取消）
+MAX_SLEEP = 1.0
+
+
+def _env_name(name: str) -> str:
+    return re.sub(r"[^0-9A-Za-z]", "_", name).upper()
+
+
+def estimate_tokens(*texts) -> int:
+    """粗略估计文本的 token 数（约 4 个字符一个 token），用于调用前预占 TPM 配额。"""
+    return sum(len(t) for t in texts if isinstance(t, str)) // 4 + 1
+
+
+class RateLimiter:
+    """
+    基于 Redis 令牌桶的分布式限流器，同一 provider / model 的所有 Runner 进程共享配额。
+
+    限额从环境变量读取（未设置或为 0 表示不限制，此时 acquire 不访问 Redis）：
+        {PROVIDER}_{MODEL}_RPM / {PROVIDER}_{MODEL}_TPM   某个模型的每分钟请求数 / token 数
+        {PROVIDER}_RPM / {PROVIDER}_TPM                   该 provider 下所有模型的默认值
+    PROVIDER 与 MODEL 中的非字母数字字符替换为下划线并转为大写，例如 VLLM_QWEN3_32B_RPM。
+
+    用法：
+        reserved = limiter.acquire(estimate_tokens(prompt))
+        response = call_provider(...)
+        limiter.settle(reserved, response_usage_tokens)   # 调用失败时 used=0，退回全部预占
+    """
+
+    def __init__(self, provider: str, model: str = "", rpm: int | None = None, tpm: int | None = None):
+        self.provider = provider
+        self.model = model
+        self.rpm = rpm if rpm is not None else self._limit("RPM")
+        self.tpm = tpm if tpm is not None else self._limit("TPM")
+        key = f"rate-limit:{provider}:{model}"
+        self._keys = [f"{key}:rpm", f"{key}:tpm"]
+
+    def _limit(self, kind):
+        provider = _env_name(self.provider)
+        if self.model:
+            value = os.getenv(f"{provider}_{_env_name(self.model)}_{kind}")
+            if value:
+                return int(value)
+        return int(os.getenv(f"{provider}_{kind}", "0"))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rpm or self.tpm)
+
+    def _try(self, tokens):
+        """尝试获取配额，返回需要等待的秒数，0 表示已获取。"""
+        ctx = get_context()
+        with Metrics.REDIS_RTT.time(op="rate_limit"):
+            wait_ms = ctx.rate_limit(keys=self._keys, args=[self.rpm, self.tpm, tokens])
+        return int(wait_ms) / 1000
+
+    def acquire(self, tokens: int = 0) -> int:
+        """
+        阻塞直到获取一个请求以及 tokens 个 token 的配额，返回预占的 token 数（供 settle 使用）。
+        等待期间检查任务是否被取消。
+        """
+        if not self.enabled:
+            return 0
+        started = None
+        while True:
+            wait = self._try(tokens)
+            if not wait:
+                break
+            if started is None:
+                started = time.monotonic()
+                THROTTLED.inc(provider=self.provider)
+            get_context().check_cancelled()
+            time.sleep(min(wait, MAX_SLEEP))
+        if started is not None:
+            WAIT.observe(time.monotonic() - started, provider=self.provider)
+        return tokens
+
+    async def aacquire(self, tokens: int = 0) -> int:
+        """acquire 的异步版本，Redis 调用在线程池中执行，等待时不阻塞事件循环。"""
+        if not self.enabled:
+            return 0
+        started = None
+        while True:
+            wait = await asyncio.to_thread(self._try, tokens)
+            if not wait:
+                break
+            if started is None:
+                started = time.monotonic()
+                THROTTLED.inc(provider=self.provider)
+            await asyncio.sleep(min(wait, MAX_SLEEP))
+        if started is not None:
+            WAIT.observe(time.monotonic() - started, provider=self.provider)
+        return tokens
+
+    def settle(self, reserved: int, used: int | None):
+        """按实际消耗修正 TPM 桶：多预占的退回，少预占的补扣（桶可以暂时为负，之后的请求相应等待）。"""
+        if not self.tpm or used is None or used == reserved:
+            return
+        redis = get_context().redis
+        # 桶已过期说明两分钟内没有调用，早已补满，无需修正
+        if redis.exists(self._keys[1]):
+            redis.hincrbyfloat(self._keys[1], "tokens", reserved - used)
+
+    async def asettle(self, reserved: int, used: int | None):
+        """settle 的异步版本，Redis 调用在线程池中执行。"""
+        if not self.tpm or used is None or used == reserved:
+            return
+        await asyncio.to_thread(self.settle, reserved, used)
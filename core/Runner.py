@@ -1,24 +1,66 @@
 import contextvars
+import functools
 import importlib
 import multiprocessing
+import multiprocessing.connection
+import os
+import socket
 import threading
+import time
+import uuid
 
+from core.Computable import Parked
 from core.ComputableResult import ComputableResult
-from core.Context import get_context, Context
+from core.Context import get_context, Context, CancelledError
+from core import trace
+from core.Hedge import HedgePolicy, LatencyTracker
+from core import Metrics
+from core.Graph import finish_node
 from core.Utils import deserialize, serialize
 
+JOBS_CONSUMED = Metrics.Counter("runner_jobs_consumed_total", "Jobs claimed and executed", ["task"])
+JOBS_FAILED = Metrics.Counter("runner_jobs_failed_total", "Jobs finished with ERROR or CANCELLED", ["task", "state"])
+QUEUE_WAIT = Metrics.Histogram("runner_queue_wait_seconds", "Time between publish and dequeue", ["task"])
+COMPUTE = Metrics.Histogram("runner_compute_seconds", "Operator compute duration", ["task"])
+DEP_FETCH = Metrics.Histogram("runner_dependency_fetch_seconds", "Time to resolve dependency results", ["task"])
+IN_FLIGHT = Metrics.Gauge("runner_jobs_in_flight", "Jobs currently executing in this process")
+PAYLOAD = Metrics.Histogram(
+    "runner_payload_bytes", "Serialized job / result size", ["kind"], buckets=Metrics.SIZE_BUCKETS
+)
+
+
+@functools.lru_cache(maxsize=None)
+def load_operator(task):
+    """按 "module.Class" 解析算子类；每个进程只解析一次，之后的消息直接命中缓存。"""
+    module_path, cls_name = task.rsplit(".", 1)
+    return getattr(importlib.import_module(module_path), cls_name)
+
 
 class Runner:
-    def __init__(self):
+    #: 节点租约时长（秒），执行期间每 1/3 租约续约一次；执行者崩溃后，
+    #: 重新投递的消息在租约过期后接管节点。
+    lease = 60.0
+
+    def __init__(self, hedge: bool = False):
         self.ctx = get_context()
         self.redis = self.ctx.redis
         self.ch = self.ctx.channel
+        self.latency = LatencyTracker(self.redis)
+        # 仅在开启时对 idempotent 算子做对冲执行
+        self.hedge_policy = HedgePolicy(self.latency) if hedge else None
+        # 执行中节点的租约：(task_key, exec_id) -> owner，由一个共享的后台线程统一续约
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+        self._lease_thread = None
 
-    def start(self):
+    def start(self, metrics_port: int | None = None):
+        if metrics_port:
+            Metrics.start_http_server(metrics_port)
+            Metrics.start_round_trip_probe(self.ctx)
         self.ch.basic_consume(queue=self.ctx.queue, on_message_callback=self._on_message)
         self.ch.start_consuming()
 
-    def process_message(self, body, delivery_tag):
+    def process_message(self, body, delivery_tag, ready_at=None):
         """
        job = {
            "exec_id": "12345",
@@ -32,34 +74,56 @@ class Runner:
        redis data structure:
        1. hash: runner-node:{task_id}
                 job:{exec_id} string (任务定义)
-                state:{exec_id} string (状态, 可选值: PENDING, RUNNING, FINISHED, ERROR)
+                state:{exec_id} string (状态, 可选值: PENDING, RUNNING, WAITING_SERVICE, FINISHED, ERROR, CANCELLED)
                 dep:{exec_id} string (依赖的任务 ID, 逗号隔开)
                 dep_cnt:{exec_id} int (任务依赖计数)
                 finish_pointer:{exec_id} string (任务完成指针, 当前任务完成时，outer才算完成)
+                hedge:{exec_id} string (已派发对冲副本的标记)
+                dispatched:{exec_id} string (挂起节点的 Service 请求已派发的标记，见 _park)
+                owner:{exec_id} string (当前执行者标识)
+                lease:{exec_id} int (执行者租约到期时间, Redis 服务器毫秒时间戳)
+                cancelled string (任务已取消的标记，值为取消原因)
        2. set: runner-node-waiters:{task_id}:{exec_id} (子任务等待队列)
        3. int: runner-node-counter:{task_id} (任务计数，用于分配 exec_id)
        4. list: runner-node-result:{task_id}:{exec_id} string (结果 / 错误信息)
+       5. list: runner-latency:{task} (按算子类统计的耗时样本, 见 core.Hedge)
+       6. stream: runner-node-trace:{task_id} (节点耗时账本, 见 core.trace)
 
+       ready_at 为消息发布时刻（毫秒，来自 AMQP header），用于统计排队耗时。
        """
+        stamps = {"dequeued": trace.now_ms()}
         job = deserialize(body)
         exec_id = job["exec_id"]
         task_id = job["task_id"]
+        PAYLOAD.observe(len(body), kind="job")
+        if ready_at is not None:
+            QUEUE_WAIT.observe(max(stamps["dequeued"] - ready_at, 0) / 1000, task=job["task"])
 
         # 设置当前上下文的任务 ID
         self.ctx.set_task(task_id)
 
         task_key = f"runner-node:{task_id}"
-        result_key = f"runner-node-result:{task_id}:{exec_id}"
+        hedge_timer = None
+        parked = False
+
+        # 认领节点：已结束的节点（重复投递或对冲失败方）直接跳过
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        if not self._claim(task_key, exec_id, owner, job.get("hedge", False)):
+            self.ctx.ack_mq_message(delivery_tag)
+            return
+        JOBS_CONSUMED.inc(task=job["task"])
+        IN_FLIGHT.inc()
+        if not job.get("hedge"):
+            self._hold_lease(task_key, exec_id, owner)
 
         try:
-            self.redis.hset(task_key, f"state:{exec_id}", "RUNNING")
             args = []
 
             def get_value(exec_id_):
                 key = f"runner-node-result:{task_id}:{exec_id_}"
                 state = self.redis.hget(task_key, f"state:{exec_id_}")
-                if state == "ERROR":
-                    raise RuntimeError(f"Previous task {arg['exec_id']} failed")
+                if state in ("ERROR", "CANCELLED"):
+                    raise RuntimeError(f"Previous task {exec_id_} failed")
                 raw = self.redis.lrange(key, 0, -1)[0]
                 return deserialize(raw)
 
@@ -80,23 +144,45 @@ class Runner:
             kwargs = {}
             for k, v in job.get("kwargs", {}).items():
                 kwargs[k] = get_value_obj(v)
+            stamps["resolved"] = trace.now_ms()
+            DEP_FETCH.observe((stamps["resolved"] - stamps["dequeued"]) / 1000, task=job["task"])
 
             # 动态加载 operator 并执行
-            module_path, cls_name = job["task"].rsplit(".", 1)
-            module = importlib.import_module(module_path)
-            cls = getattr(module, cls_name)
+            cls = load_operator(job["task"])
             init_args = job.get("init_args", [])
             init_kwargs = job.get("init_kwargs", {})
             instance = cls(*init_args, **init_kwargs)
             compute = instance.compute
 
+            # 对冲：原始副本运行超过阈值时派发一个副本
+            if self.hedge_policy and getattr(cls, "idempotent", False) and not job.get("hedge"):
+                delay = self.hedge_policy.threshold(job["task"])
+                if delay is not None:
+                    hedge_timer = threading.Timer(delay, self._hedge, args=(task_id, exec_id))
+                    hedge_timer.daemon = True
+                    hedge_timer.start()
+
+            stamps["start"] = trace.now_ms()
+            start = time.monotonic()
             res = compute(*args, **kwargs)
+            elapsed = time.monotonic() - start
+            if self.hedge_policy and getattr(cls, "idempotent", False):
+                # 耗时样本只用于计算可对冲算子的阈值，未开启对冲时不写 Redis
+                self.latency.record(job["task"], elapsed)
+            COMPUTE.observe(elapsed, task=job["task"])
+            stamps["end"] = trace.now_ms()
         except Exception as e:
             # 获取递归栈
             import traceback
             stack = traceback.format_exc()
-            self.redis.hset(task_key, f"state:{exec_id}", "ERROR")
-            self.redis.lpush(result_key, serialize({"error": str(e), "stack": stack})[1])
+            state = "CANCELLED" if isinstance(e, CancelledError) else "ERROR"
+            JOBS_FAILED.inc(task=job["task"], state=state)
+            if job.get("hedge"):
+                # 对冲副本失败时原始副本仍在运行，由原始副本完成节点
+                print(f"任务 {exec_id} 的对冲副本执行失败，等待原始副本: {e}")
+                self.ctx.ack_mq_message(delivery_tag)
+                return
+            self._finish(task_id, exec_id, state, serialize({"error": str(e), "stack": stack})[1])
             self.ctx.ack_mq_message(delivery_tag)
             print(f"任务 {exec_id} 执行失败: {e}")
             print(stack)
@@ -108,37 +194,168 @@ class Runner:
                 last_exec_id = res.exec_id
                 # 更新 finish_pointer
                 self.redis.hset(task_key, f"finish_pointer:{last_exec_id}", str(exec_id))
+            elif isinstance(res, Parked):
+                # 结果由 Service 写入，不占用当前线程等待
+                parked = True
+                self._park(task_id, exec_id, res)
             else:
-                finish_exec_id_list = [exec_id]
-                while True:
-                    now_exec_id = finish_exec_id_list[-1]
-                    last_exec_id = self.redis.hget(task_key, f"finish_pointer:{now_exec_id}")
-                    if last_exec_id is None:
-                        break
-                    finish_exec_id_list.append(int(last_exec_id))
-
-                for feid in finish_exec_id_list:
-                    self.redis.hset(task_key, f"state:{feid}", "FINISHED")
-                    self.redis.lpush(f"runner-node-result:{task_id}:{feid}", serialize(res)[1])
-                    # 调度子任务
-                    children = self.redis.smembers(f"runner-node-waiters:{task_id}:{feid}") or []
-                    for cid in children:
-                        cnt = self.redis.hincrby(task_key, f"dep_cnt:{cid}", -1)
-                        if cnt == 0:
-                            # 发布到同一个队列
-                            self.ctx.send_mq_message(self.redis.hget(task_key, f"job:{cid}").encode('latin1'))
+                payload = serialize(res)[1]
+                PAYLOAD.observe(len(payload), kind="result")
+                self._finish(task_id, exec_id, "FINISHED", payload)
             self.ctx.ack_mq_message(delivery_tag)
+        finally:
+            IN_FLIGHT.dec()
+            self._release_lease(task_key, exec_id)
+            if hedge_timer is not None:
+                hedge_timer.cancel()
+            if self.ctx.trace:
+                # 挂起的节点由 Service 在写入结果时记录 stored
+                if not parked:
+                    stamps["stored"] = trace.now_ms()
+                trace.record(self.redis, task_id, exec_id, **stamps)
+
+    def _claim(self, task_key, exec_id, owner, hedge=False):
+        """
+        PENDING -> RUNNING 的原子认领。租约被其他存活的执行者持有时等待其过期后接管；
+        节点已结束时返回 False。
+        """
+        while True:
+            with Metrics.REDIS_RTT.time(op="claim_task"):
+                rv = int(self.ctx.claim_task(
+                    keys=[task_key], args=[exec_id, owner, int(self.lease * 1000), "1" if hedge else "0"]
+                ))
+            if rv >= 0:
+                return rv == 1
+            time.sleep(min(-rv / 1000, 5.0))
+
+    def _hold_lease(self, task_key, exec_id, owner):
+        with self._leases_lock:
+            self._leases[(task_key, exec_id)] = owner
+            if self._lease_thread is None:
+                self._lease_thread = threading.Thread(
+                    target=contextvars.copy_context().run, args=(self._renew_leases,), daemon=True
+                )
+                self._lease_thread.start()
+
+    def _release_lease(self, task_key, exec_id):
+        with self._leases_lock:
+            self._leases.pop((task_key, exec_id), None)
+
+    def _renew_leases(self):
+        """每 1/3 租约为所有执行中的节点续约一次，不为每条消息单独启动线程。"""
+        while True:
+            time.sleep(self.lease / 3)
+            with self._leases_lock:
+                leases = list(self._leases.items())
+            for (task_key, exec_id), owner in leases:
+                try:
+                    # 同一 owner 再次认领即为续约
+                    with Metrics.REDIS_RTT.time(op="claim_task"):
+                        rv = int(self.ctx.claim_task(
+                            keys=[task_key], args=[exec_id, owner, int(self.lease * 1000), "0"]
+                        ))
+                except Exception as e:
+                    print(f"任务 {exec_id} 续约失败: {e}")
+                    continue
+                if rv != 1:
+                    # 节点已结束或租约已被接管，停止续约
+                    self._release_lease(task_key, exec_id)
+
+    def _finish(self, task_id, exec_id, state, result):
+        # 子任务发布到同一个队列
+        finish_node(self.ctx, task_id, exec_id, state, result)
+
+    def _park(self, task_id, exec_id, parked):
+        """
+        RUNNING -> WAITING_SERVICE 后再派发请求，保证 Service 的响应不会早于挂起。
+        派发成功后写入 dispatched 标记；Runner 在标记写入前退出时消息被重新投递，
+        claim_task 会接管没有标记的挂起节点并重新执行，避免节点永远等待不会到来的响应。
+        """
+        task_key = f"runner-node:{task_id}"
+        if not int(self.ctx.park_task(keys=[task_key], args=[exec_id])):
+            return
+        try:
+            parked.dispatch({"task_id": task_id, "exec_id": exec_id, "queue": self.ctx.queue})
+        except Exception as e:
+            import traceback
+            self._finish(task_id, exec_id, "ERROR", serialize({"error": str(e), "stack": traceback.format_exc()})[1])
+            return
+        self.redis.hset(task_key, f"dispatched:{exec_id}", "1")
+
+    def _hedge(self, task_id, exec_id):
+        task_key = f"runner-node:{task_id}"
+        # 每个节点最多派发一个对冲副本
+        if not self.redis.hsetnx(task_key, f"hedge:{exec_id}", "1"):
+            return
+        if self.redis.hget(task_key, f"state:{exec_id}") != "RUNNING":
+            return
+        job = deserialize(self.redis.hget(task_key, f"job:{exec_id}"))
+        job["hedge"] = True
+        print(f"任务 {exec_id} 运行超时，派发对冲副本")
+        self.ctx.send_mq_message(serialize(job)[0])
 
     def _on_message(self, ch, method, props, body):
         context_for_thread = contextvars.copy_context()
+        ready_at = (props.headers or {}).get("ready_at")
         worker_thread = threading.Thread(
             target=self._thread_wrapper,
-            args=(context_for_thread, body, method.delivery_tag)
+            args=(context_for_thread, body, method.delivery_tag, ready_at)
         )
         worker_thread.start()
 
-    def _thread_wrapper(self, context, body, delivery_tag):
-        context.run(self.process_message, body, delivery_tag)
+    def _thread_wrapper(self, context, body, delivery_tag, ready_at=None):
+        context.run(self.process_message, body, delivery_tag, ready_at)
+
+
+#: --preload 不带参数时预加载的模块。算子模块本身已延迟导入 SDK，因此同时预加载 litellm
+DEFAULT_PRELOAD = ["coper.basic_ops", "coper.LLM", "coper.Embedding", "litellm"]
+
+
+def _worker(index, router, hedge, metrics_port):
+    with Context(router=router):
+        runner = Runner(hedge=hedge)
+        runner.start(metrics_port=metrics_port + index if metrics_port else None)
+
+
+def serve(workers=16, router="", hedge=False, metrics_port=0, preload=None):
+    """
+    启动 workers 个 Runner 子进程，子进程退出后自动重启。
+
+    preload 为模块名列表时使用 forkserver：fork server 进程只导入一次这些模块，
+    之后每个 worker（包括重启的 worker）都从它 fork 出来，以写时复制方式共享已导入的代码页，
+    只需各自建立连接。父进程本身不持有任何连接。
+    """
+    if preload:
+        mp = multiprocessing.get_context("forkserver")
+        # core.Runner 作为 __main__ 启动时，子进程会以 __mp_main__ 重新执行本文件，
+        # 不能再预加载 core.Runner，否则同一份指标会注册两次
+        mp.set_forkserver_preload(["core.Computable"] + list(preload))
+    else:
+        mp = multiprocessing.get_context()
+
+    def spawn(index):
+        p = mp.Process(target=_worker, args=(index, router, hedge, metrics_port), daemon=True)
+        p.start()
+        return p, time.monotonic()
+
+    procs = {i: spawn(i) for i in range(workers)}
+    try:
+        while True:
+            sentinels = {p.sentinel: i for i, (p, _) in procs.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                i = sentinels[sentinel]
+                p, started = procs[i]
+                p.join()
+                print(f"worker {i} (pid {p.pid}) exited with code {p.exitcode}, restarting")
+                # 启动后立即崩溃时退避，避免重启风暴
+                if time.monotonic() - started < 1.0:
+                    time.sleep(1.0)
+                procs[i] = spawn(i)
+    except KeyboardInterrupt:
+        for p, _ in procs.values():
+            p.terminate()
+        for p, _ in procs.values():
+            p.join()
 
 
 if __name__ == "__main__":
@@ -146,18 +363,23 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--router", default="", help="Router name to listen to (queue: runner_task_queue_{router})")
+    parser.add_argument("--hedge", action="store_true", help="Speculatively re-dispatch slow idempotent nodes")
+    parser.add_argument(
+        "--metrics-port", type=int, default=int(os.getenv("RUNNER_METRICS_PORT", "0")),
+        help="Base port for Prometheus metrics; worker i listens on base + i (0 disables)",
+    )
+    parser.add_argument("--workers", type=int, default=16, help="Number of worker processes")
+    parser.add_argument(
+        "--preload", nargs="?", const=",".join(DEFAULT_PRELOAD), default="",
+        help="Comma separated modules to import once in a fork server before forking workers "
+             f"(default when given without a value: {','.join(DEFAULT_PRELOAD)})",
+    )
     args = parser.parse_args()
 
-    def run():
-        with Context(router=args.router):
-            runner = Runner()
-            runner.start()
-
-    mpl = []
-    for _ in range(16):
-        p = multiprocessing.Process(target=run)
-        p.start()
-        mpl.append(p)
-
-    for p in mpl:
-        p.join()
+    serve(
+        workers=args.workers,
+        router=args.router,
+        hedge=args.hedge,
+        metrics_port=args.metrics_port,
+        preload=[m for m in args.preload.split(",") if m],
+    )
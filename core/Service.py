@@ -1,7 +1,133 @@
+import contextvars
+import io
 import json
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from core.Computable import Computable
-from core.Utils import deserialize
+from core.Context import queue_arguments
+from core import Metrics, trace
+from core.Graph import finish_node
+from core.Utils import deserialize, serialize
+
+REQUESTS = Metrics.Counter("service_requests_total", "Requests consumed", ["service"])
+REQUESTS_FAILED = Metrics.Counter("service_requests_failed_total", "Requests that raised", ["service"])
+QUEUE_WAIT = Metrics.Histogram("service_queue_wait_seconds", "Time between publish and dequeue", ["service"])
+COMPUTE = Metrics.Histogram("service_compute_seconds", "Service compute duration", ["service"])
+IN_FLIGHT = Metrics.Gauge("service_requests_in_flight", "Requests currently executing")
+BATCH_SIZE = Metrics.Histogram(
+    "service_batch_size", "Requests per compute_batch call", ["service"], buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+PAYLOAD = Metrics.Histogram(
+    "service_payload_bytes", "Request / response size", ["kind"], buckets=Metrics.SIZE_BUCKETS
+)
+
+# 响应协议
+#   Service 向返回队列写入 core.Utils.serialize 编码的信封：
+#     {"v": 1, "status": "success", "result": ...}
+#     {"v": 1, "status": "error", "message": ..., "stack": ...}
+#   信封超过 RESPONSE_OFFLOAD_BYTES 时写入 MinIO，返回队列中只放引用：
+#     {"v": 1, "offload": {"bucket": ..., "object_name": ..., "size": ...}}
+#   返回队列设置 RESPONSE_TTL 秒过期，调用方已放弃时响应不会一直占用内存。
+#   旧版本 Service 写入的 JSON 响应仍可解析。
+RESPONSE_VERSION = 1
+RESPONSE_TTL = int(os.getenv("SERVICE_RESPONSE_TTL", "3600"))
+RESPONSE_OFFLOAD_BYTES = int(os.getenv("SERVICE_RESPONSE_OFFLOAD_BYTES", str(1024 * 1024)))
+RESPONSE_BUCKET = os.getenv("SERVICE_RESPONSE_BUCKET", "service-responses")
+
+# 服务注册表
+#   services                                   已注册过的服务 ID 集合
+#   service-replicas:{service_id}              副本 ID 集合
+#   service-replica:{service_id}:{replica_id}  副本信息：queue / capacity / in_flight / host / pid / started_at / heartbeat_at
+#   副本每 SERVICE_HEARTBEAT_INTERVAL 秒上报一次 in_flight 并续期 SERVICE_REPLICA_TTL 秒，
+#   进程退出或失联后副本信息自动过期，路由时顺便从副本集合中移除。
+#   每个副本消费自己的队列 service.request.{service_id}.{replica_id} 以及共享队列 service.request.{service_id}；
+#   副本队列中超过 SERVICE_REPLICA_TTL 秒未被取走的请求转入共享队列，由其他副本处理。
+HEARTBEAT_INTERVAL = float(os.getenv("SERVICE_HEARTBEAT_INTERVAL", "5"))
+REPLICA_TTL = int(os.getenv("SERVICE_REPLICA_TTL", "15"))
+
+
+def request_queue(service_id):
+    """服务的共享请求队列。"""
+    return f"service.request.{service_id}"
+
+
+def route(ctx, service_id):
+    """选出负载最低的存活副本，返回其请求队列名；没有存活副本时抛出 RuntimeError。"""
+    with Metrics.REDIS_RTT.time(op="route_service"):
+        queue_name = ctx.route_service(keys=[f"service-replicas:{service_id}"], args=[f"service-replica:{service_id}"])
+    if queue_name is None:
+        raise RuntimeError(f"No live replica for service {service_id}")
+    return queue_name
+
+
+def replicas(ctx, service_id):
+    """返回服务当前存活副本的信息列表。"""
+    replica_ids = sorted(ctx.redis.smembers(f"service-replicas:{service_id}"))
+    pipe = ctx.redis.pipeline(transaction=False)
+    for replica_id in replica_ids:
+        pipe.hgetall(f"service-replica:{service_id}:{replica_id}")
+    return [{"replica_id": r, **info} for r, info in zip(replica_ids, pipe.execute()) if info]
+
+
+_bucket_lock = threading.Lock()
+_bucket_ready = False
+
+
+def _ensure_response_bucket(minio):
+    """创建响应桶，并设置 1 天后过期，兜底清理调用方未取走的大响应。"""
+    global _bucket_ready
+    with _bucket_lock:
+        if _bucket_ready:
+            return
+        if not minio.bucket_exists(RESPONSE_BUCKET):
+            minio.make_bucket(RESPONSE_BUCKET)
+            try:
+                from minio.commonconfig import ENABLED, Filter
+                from minio.lifecycleconfig import Expiration, LifecycleConfig, Rule
+                minio.set_bucket_lifecycle(RESPONSE_BUCKET, LifecycleConfig([
+                    Rule(ENABLED, rule_filter=Filter(prefix=""), rule_id="expire", expiration=Expiration(days=1))
+                ]))
+            except Exception as e:
+                print(f"[WARNING] 无法为 {RESPONSE_BUCKET} 设置过期策略: {e}")
+        _bucket_ready = True
+
+
+def encode_response(ctx, rv, object_name):
+    """把响应编码为写入返回队列的字符串，过大时转存到 MinIO。"""
+    data, text = serialize({"v": RESPONSE_VERSION, **rv})
+    if len(data) <= RESPONSE_OFFLOAD_BYTES:
+        return text
+    _ensure_response_bucket(ctx.minio)
+    ctx.minio.put_object(RESPONSE_BUCKET, object_name, io.BytesIO(data), len(data))
+    ref = {"bucket": RESPONSE_BUCKET, "object_name": object_name, "size": len(data)}
+    return serialize({"v": RESPONSE_VERSION, "offload": ref})[1]
+
+
+def decode_response(ctx, raw):
+    """解析返回队列中的响应，返回 {"status", "result"} 或 {"status", "message", "stack"}。"""
+    if raw.startswith("{"):
+        # 旧版本 Service 的 JSON 响应（msgpack 编码的 map 不会以 "{" 开头）
+        return json.loads(raw)
+    rv = deserialize(raw)
+    if rv.get("v", 0) > RESPONSE_VERSION:
+        raise ValueError(f"Unsupported service response version {rv['v']}")
+    ref = rv.get("offload")
+    if ref:
+        response = ctx.minio.get_object(ref["bucket"], ref["object_name"])
+        try:
+            rv = deserialize(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+        ctx.minio.remove_object(ref["bucket"], ref["object_name"])
+    return rv
 
 
 class Service(Computable):
@@ -25,21 +151,75 @@ class Service(Computable):
 
     服务类，用于定义一个计算服务，其本质是一个具有状态的 Computable 对象，可以通过 prepare 方法准备计算环境，并在计算时使用。
     服务可以分布式的运行在任意的机器上，通过 RabbitMQ 获取输入数据，在计算完成之后，向指定的队列发送计算结果。
+
+    并发：concurrency 为单个实例同时处理的请求数（prefetch 与线程池大小），默认 1。
+    compute 可以安全地被多个线程同时调用（状态可共享）的服务可以调大该值，
+    也可以通过 run(concurrency=...) 或环境变量 SERVICE_CONCURRENCY 指定。
+
+    批处理：batch_size > 1 时，请求先进入批队列，凑满 batch_size 个或等待 batch_wait_ms 毫秒后
+    一次性交给 compute_batch（并发模式下同时可以有 concurrency 批在处理），结果再分发回各自的返回队列。
+    适合 OCR、Embedding、TTS 等批量推理吞吐更高的服务。
     """
 
+    #: 单个实例同时处理的请求数
+    concurrency = 1
+
+    #: 批处理：最多凑 batch_size 个请求，自第一个请求起最多等待 batch_wait_ms 毫秒，
+    #: 然后调用 compute_batch。batch_size 为 1 时不启用批处理。
+    batch_size = 1
+    batch_wait_ms = 10
+
     def __register(self):
         """
-        注册服务到中心节点，使用 AuthKey 进行身份验证。
+        把当前副本写入注册表（Redis），并设置 REPLICA_TTL 秒过期。
         如果注册成功，则返回 True，否则返回 False。
         """
-        pass
+        now = int(time.time())
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hset(self._replica_key, mapping={
+                "queue": self.replica_queue,
+                "capacity": self._capacity,
+                "in_flight": self._in_flight,
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "started_at": now,
+                "heartbeat_at": now,
+            })
+            pipe.expire(self._replica_key, REPLICA_TTL)
+            pipe.sadd(f"service-replicas:{self.service_id}", self.replica_id)
+            pipe.sadd("services", self.service_id)
+            pipe.execute()
+        except Exception as e:
+            print(f"[WARNING] 服务 {self.service_id} 注册失败: {e}")
+            return False
+        return True
 
     def __heartbeat(self):
         """
-        心跳进程，负责定期向中心节点发送心跳信息。
-        如果心跳消失，则自动清除注册的结果。
+        心跳线程，定期上报 in_flight 并续期注册信息，直到 run 退出。
+        如果注册信息已经过期（例如 Redis 长时间不可达），则重新注册。
         """
-        pass
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                pipe = self.redis.pipeline(transaction=True)
+                pipe.expire(self._replica_key, REPLICA_TTL)
+                pipe.hset(self._replica_key, mapping={"in_flight": self._in_flight, "heartbeat_at": int(time.time())})
+                alive, _ = pipe.execute()
+            except Exception as e:
+                print(f"[WARNING] 服务 {self.service_id} 心跳失败: {e}")
+                continue
+            if not alive:
+                self.__register()
+
+    def __deregister(self):
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(self._replica_key)
+            pipe.srem(f"service-replicas:{self.service_id}", self.replica_id)
+            pipe.execute()
+        except Exception as e:
+            print(f"[WARNING] 服务 {self.service_id} 注销失败: {e}")
 
     def initialize(self):
         raise NotImplementedError("Subclasses must implement the initialize method.")
@@ -50,39 +230,216 @@ class Service(Computable):
         # Computable does not expose a RabbitMQ channel attribute. Retrieve it
         # from the current context so ``run`` can interact with the queue.
         self.ch = self.ctx.channel
+        self._pool = None
+        self._batch_queue = None
+        # 注册表中的副本信息
+        self.replica_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.replica_queue = f"{request_queue(service_id)}.{self.replica_id}"
+        self._replica_key = f"service-replica:{service_id}:{self.replica_id}"
+        self._capacity = 1
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._stopped = threading.Event()
 
     def _on_message(self, ch, method, properties, body):
         """
-        处理接收到的消息。
+        在消费线程上收到消息：批处理模式下放入批队列，并发模式下交给线程池处理，否则直接处理。
+        每条消息运行在复制出的 contextvars 上下文中，任务 ID 互不干扰。
+        """
+        if self._batch_queue is not None:
+            self._batch_queue.put((method.delivery_tag, properties, body))
+            return
+        context = contextvars.copy_context()
+        if self._pool is None:
+            context.run(self._handle, method.delivery_tag, properties, body)
+        else:
+            self._pool.submit(context.run, self._handle, method.delivery_tag, properties, body)
+
+    def _accept(self, properties, body):
+        ready_at = (properties.headers or {}).get("ready_at")
+        if ready_at is not None:
+            QUEUE_WAIT.observe(max(time.time() * 1000 - ready_at, 0) / 1000, service=self.service_id)
+        REQUESTS.inc(service=self.service_id)
+        PAYLOAD.observe(len(body), kind="request")
+        IN_FLIGHT.inc()
+        with self._in_flight_lock:
+            self._in_flight += 1
+        return deserialize(body)
+
+    def _error(self, e, stack=None):
+        REQUESTS_FAILED.inc(service=self.service_id)
+        return {"status": "error", "message": str(e), "stack": stack or traceback.format_exc()}
+
+    def _reply(self, delivery_tag, task, rv):
+        """
+        写回结果并（线程安全地）确认消息。
+        请求带有 node（continuation 模式）时不写返回队列，而是直接完成调用方的节点。
+        """
+        try:
+            if task.get("node"):
+                self._complete_node(task["node"], rv)
+            else:
+                self._respond(task["return_queue"], rv)
+        finally:
+            # pika 连接不是线程安全的，确认消息交由连接所在线程执行
+            self.ctx.ack_mq_message(delivery_tag)
+            IN_FLIGHT.dec()
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def _handle(self, delivery_tag, properties, body):
+        """
+        处理一条请求并把结果写入返回队列。
         子类可以重写此方法以实现自定义的消息处理逻辑。
         """
-        task = deserialize(body)
+        task = self._accept(properties, body)
         self.ctx.set_task(task["task_id"])
-        return_queue = task["return_queue"]
-        args = task["args"]
-        kwargs = task["kwargs"]
-        rv = {}
         try:
-            res = self.compute(*args, **kwargs)
+            with COMPUTE.time(service=self.service_id):
+                res = self.compute(*task["args"], **task["kwargs"])
+        except Exception as e:
+            rv = self._error(e)
+        else:
+            rv = {"status": "success", "result": res}
+        self._reply(delivery_tag, task, rv)
+
+    def compute_batch(self, requests):
+        """
+        批处理钩子：requests 为 [(args, kwargs), ...]，返回等长的结果列表。
+        某一项失败时可以在对应位置返回 Exception 实例，只影响该请求；抛出异常则整批失败。
+        默认逐个调用 compute，支持批量推理的服务应重写该方法。
+        """
+        results = []
+        for args, kwargs in requests:
+            try:
+                results.append(self.compute(*args, **kwargs))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _handle_batch(self, items):
+        """处理一批 (delivery_tag, properties, body)，调用 compute_batch 后把结果分发回各自的返回队列。"""
+        tasks = [self._accept(properties, body) for _, properties, body in items]
+        BATCH_SIZE.observe(len(tasks), service=self.service_id)
+        try:
+            with COMPUTE.time(service=self.service_id):
+                results = self.compute_batch([(t["args"], t["kwargs"]) for t in tasks])
+            if len(results) != len(tasks):
+                raise ValueError(f"compute_batch returned {len(results)} results for {len(tasks)} requests")
         except Exception as e:
-            import traceback
             stack = traceback.format_exc()
-            rv["status"] = "error"
-            rv["message"] = str(e)
-            rv["stack"] = stack
+            rvs = [self._error(e, stack) for _ in tasks]
         else:
-            rv["status"] = "success"
-            rv["result"] = res
-        finally:
-            self.redis.lpush(return_queue, json.dumps(rv))
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            rvs = [
+                self._error(r, "".join(traceback.format_exception(r))) if isinstance(r, Exception)
+                else {"status": "success", "result": r}
+                for r in results
+            ]
+        for (delivery_tag, _, _), task, rv in zip(items, tasks, rvs):
+            self._reply(delivery_tag, task, rv)
+
+    def _batch_loop(self, batch_size, batch_wait_ms):
+        """凑满 batch_size 个请求，或自第一个请求起等待 batch_wait_ms 毫秒后提交一批。"""
+        while True:
+            items = [self._batch_queue.get()]
+            deadline = time.monotonic() + batch_wait_ms / 1000
+            while len(items) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._batch_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if self._pool is None:
+                self._handle_batch(items)
+            else:
+                self._pool.submit(contextvars.copy_context().run, self._handle_batch, items)
+
+    def _respond(self, return_queue, rv):
+        try:
+            response = encode_response(self.ctx, rv, return_queue)
+        except Exception as e:
+            # 结果无法编码或转存失败时，也要让调用方收到错误而不是一直等待
+            response = encode_response(
+                self.ctx,
+                {"status": "error", "message": f"Failed to encode response: {e}", "stack": traceback.format_exc()},
+                return_queue,
+            )
+        PAYLOAD.observe(len(response), kind="response")
+        with Metrics.REDIS_RTT.time(op="lpush"):
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lpush(return_queue, response)
+            pipe.expire(return_queue, RESPONSE_TTL)
+            pipe.execute()
+
+    def _complete_node(self, node, rv):
+        """通过 finish_task 写入节点结果（与 Runner 相同的完成路径），并把子任务发布到调用方的 Runner 队列。"""
+        if rv["status"] == "success":
+            state, payload = "FINISHED", serialize(rv["result"])[1]
+        else:
+            state, payload = "ERROR", serialize({"error": rv["message"], "stack": rv["stack"]})[1]
+        PAYLOAD.observe(len(payload), kind="response")
+        finish_node(self.ctx, node["task_id"], node["exec_id"], state, payload, queue=node["queue"])
+        if self.ctx.trace:
+            trace.record(self.redis, node["task_id"], node["exec_id"], stored=trace.now_ms())
 
-    def run(self):
+    def run(self, metrics_port: int | None = None, concurrency: int | None = None,
+            batch_size: int | None = None, batch_wait_ms: float | None = None):
+        """
+        metrics_port: 导出 Prometheus 指标的本地端口，默认读取 SERVICE_METRICS_PORT，未设置则不导出。
+        concurrency: 同时处理的请求（批）数，默认读取 SERVICE_CONCURRENCY，否则使用类属性 concurrency。
+        batch_size / batch_wait_ms: 批处理参数，默认读取 SERVICE_BATCH_SIZE / SERVICE_BATCH_WAIT_MS，
+            否则使用同名类属性。
+        """
+        metrics_port = metrics_port or int(os.getenv("SERVICE_METRICS_PORT", "0"))
+        concurrency = concurrency or int(os.getenv("SERVICE_CONCURRENCY", "0")) or self.concurrency
+        batch_size = batch_size or int(os.getenv("SERVICE_BATCH_SIZE", "0")) or self.batch_size
+        if batch_wait_ms is None:
+            batch_wait_ms = float(os.getenv("SERVICE_BATCH_WAIT_MS", self.batch_wait_ms))
+        if metrics_port:
+            Metrics.start_http_server(metrics_port)
+            Metrics.start_round_trip_probe(self.ctx)
         self.initialize()
-        queue_name = f"service.request.{self.service_id}"
-        self.ch.queue_declare(queue=queue_name, durable=True)
+        queue_name = request_queue(self.service_id)
+        self.ch.queue_declare(queue=queue_name, durable=True, arguments=queue_arguments())
+        # 副本队列：积压超过 REPLICA_TTL 的请求（包括副本退出时未确认的请求）转入共享队列，
+        # 副本消失一段时间后队列自动删除
+        self.ch.queue_declare(queue=self.replica_queue, durable=True, arguments={
+            **(queue_arguments() or {}),
+            "x-message-ttl": REPLICA_TTL * 1000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": queue_name,
+            "x-expires": REPLICA_TTL * 4 * 1000,
+        })
+        # 批处理时每个处理中的批都需要 batch_size 条消息，预取量相应放大；
+        # 两个队列共享同一个预取额度（global_qos）。mq_connect 已在该通道上设置了每个消费者 1 条的预取，
+        # RabbitMQ 同时执行两种限制，因此每个消费者的预取也要放大到 _capacity，否则每个队列只能持有一条消息
+        self._capacity = concurrency * batch_size
+        self.ch.basic_qos(prefetch_count=self._capacity)
+        self.ch.basic_qos(prefetch_count=self._capacity, global_qos=True)
+        if concurrency > 1:
+            self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"service-{self.service_id}")
+        if batch_size > 1:
+            self._batch_queue = queue.Queue()
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(self._batch_loop, batch_size, batch_wait_ms),
+                daemon=True,
+            ).start()
+        self.ch.basic_consume(queue=self.replica_queue, on_message_callback=self._on_message)
         self.ch.basic_consume(
             queue=queue_name, on_message_callback=self._on_message
         )
-        print("Service is running and waiting for messages...")
-        self.ch.start_consuming()
+        self.__register()
+        self._stopped.clear()
+        threading.Thread(target=contextvars.copy_context().run, args=(self.__heartbeat,), daemon=True).start()
+        print(f"Service {self.replica_id} is running and waiting for messages "
+              f"(concurrency={concurrency}, batch_size={batch_size})...")
+        try:
+            self.ch.start_consuming()
+        finally:
+            self._stopped.set()
+            self.__deregister()
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
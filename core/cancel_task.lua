@@ -0,0 +1,35 @@
+-- KEYS[1]  => task_key
+-- KEYS[2]  => task_waiter_key 前缀 (runner-node-waiters:{task_id})
+-- KEYS[3]  => result_key 前缀 (runner-node-result:{task_id})
+-- ARGV[1]  => 取消原因 (序列化后的字符串，作为被取消节点的结果)
+-- 返回值   => 本次被标记为 CANCELLED 的节点数
+-- 正在运行的节点不会被打断，由算子通过 cancelled 标记自行协作退出；
+-- 等待 Service 响应（WAITING_SERVICE）的节点没有 Runner 线程持有，直接取消，之后到达的响应被丢弃。
+-- 与 finish_task.lua 的失败分支相同，被取消节点的下游节点与等待它们的外层节点（finish_pointer）一并取消，
+-- 否则把完成交给内层节点的 RUNNING 外层节点永远不会结束
+
+local task_key = KEYS[1]
+local task_waiter_key = KEYS[2]
+local result_key = KEYS[3]
+local reason = ARGV[1]
+
+-- #include node_lib.lua
+
+redis.call('HSET', task_key, 'cancelled', reason)
+
+local cancelled = {}
+local fields = redis.call('HGETALL', task_key)
+for i = 1, #fields, 2 do
+  local field = fields[i]
+  local state = fields[i + 1]
+  if string.sub(field, 1, 6) == 'state:' and (state == 'PENDING' or state == 'WAITING_SERVICE') then
+    cancelled[#cancelled + 1] = string.sub(field, 7)
+  end
+end
+
+for _, id in ipairs(cancelled) do
+  terminate(id, 'CANCELLED', reason)
+end
+
+local cnt = #cancelled
+return cnt + cancel_downstream(cancelled, reason)
@@ -0,0 +1,47 @@
+-- KEYS[1]  => task_key
+-- ARGV[1]  => exec_id
+-- ARGV[2]  => owner (当前执行者标识)
+-- ARGV[3]  => lease_ms (租约时长，毫秒)
+-- ARGV[4]  => hedge ('1' 表示对冲副本)
+-- 返回值   => 1  认领成功（PENDING -> RUNNING，或接管过期租约，或同一 owner 续约，
+--                或接管已挂起但请求未派发的节点：Runner 在 park_task 之后、派发完成之前退出，消息被重新投递）
+--             0  节点已经结束（重复投递），应直接跳过
+--             <0 租约仍被其他 owner 持有，返回值的绝对值为剩余毫秒数，调用方应等待后重试
+
+local task_key = KEYS[1]
+local exec_id  = ARGV[1]
+local owner    = ARGV[2]
+local lease_ms = tonumber(ARGV[3])
+local hedge    = ARGV[4]
+
+local state = redis.call('HGET', task_key, 'state:' .. exec_id)
+if state == 'WAITING_SERVICE' then
+  -- 请求已派发（见 Runner._park 的 dispatched 标记）时由 Service 完成节点；对冲副本不接管
+  if hedge == '1' or redis.call('HEXISTS', task_key, 'dispatched:' .. exec_id) == 1 then
+    return 0
+  end
+elseif state ~= 'PENDING' and state ~= 'RUNNING' then
+  return 0
+end
+
+-- 使用 Redis 服务器时间，避免多台机器之间的时钟偏差
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+if state == 'RUNNING' then
+  -- 对冲副本与原副本并行执行，不接管租约
+  if hedge == '1' then
+    return 1
+  end
+  local lease = tonumber(redis.call('HGET', task_key, 'lease:' .. exec_id) or '0')
+  local holder = redis.call('HGET', task_key, 'owner:' .. exec_id)
+  if lease > now and holder ~= owner then
+    return now - lease
+  end
+end
+
+redis.call('HSET', task_key,
+  'state:' .. exec_id, 'RUNNING',
+  'owner:' .. exec_id, owner,
+  'lease:' .. exec_id, now + lease_ms)
+return 1
@@ -0,0 +1,59 @@
+-- KEYS[1]  => task_key
+-- KEYS[2]  => task_waiter_key 前缀 (runner-node-waiters:{task_id})
+-- KEYS[3]  => result_key 前缀 (runner-node-result:{task_id})
+-- ARGV[1]  => exec_id
+-- ARGV[2]  => 终止状态 (FINISHED / ERROR / CANCELLED)
+-- ARGV[3]  => 结果 / 错误信息 (序列化后的字符串)
+-- Runner 与 Service（continuation 模式）都通过该脚本完成节点
+-- 返回值   => {1, cid, ready_job, ...} 表示本次完成生效，(cid, ready_job) 为依赖已满足、需要发布的子任务；
+--             {0} 表示节点已被其他副本完成（对冲或重复投递），结果应被丢弃
+
+local task_key = KEYS[1]
+local task_waiter_key = KEYS[2]
+local result_key = KEYS[3]
+local exec_id = ARGV[1]
+local final_state = ARGV[2]
+local result = ARGV[3]
+
+-- #include node_lib.lua
+
+-- 先到先得：节点已经结束时直接返回，保证子任务计数只递减一次
+if not is_active(exec_id) then
+  return {0}
+end
+
+-- 沿 finish_pointer 找到所有等待当前节点完成的外层节点，外层节点与当前节点同时结束
+local finish_list = {exec_id}
+local now_id = exec_id
+while true do
+  local outer_id = redis.call('HGET', task_key, 'finish_pointer:' .. now_id)
+  if not outer_id or not is_active(outer_id) then
+    break
+  end
+  finish_list[#finish_list + 1] = outer_id
+  now_id = outer_id
+end
+
+local ready = {1}
+for _, feid in ipairs(finish_list) do
+  terminate(feid, final_state, result)
+end
+
+if final_state == 'FINISHED' then
+  -- 调度子任务（已取消的子任务不再发布）
+  for _, feid in ipairs(finish_list) do
+    local children = redis.call('SMEMBERS', task_waiter_key .. ':' .. feid)
+    for _, cid in ipairs(children) do
+      local cnt = redis.call('HINCRBY', task_key, 'dep_cnt:' .. cid, -1)
+      if cnt == 0 and get_state(cid) == 'PENDING' then
+        ready[#ready + 1] = cid
+        ready[#ready + 1] = redis.call('HGET', task_key, 'job:' .. cid)
+      end
+    end
+  end
+else
+  -- 失败或取消：所有下游节点（及等待它们的外层节点）标记为 CANCELLED，不再发布
+  cancel_downstream(finish_list, result)
+end
+
+return ready
@@ -1,32 +1,78 @@
--- KEYS[1]  => task_id
--- ARGV[1]  => exec_id
--- ARGV[2]  => job (任务定义，字符串)
--- ARGV[3]  => dep (逗号分隔的依赖 exec_id 列表，字符串)
+-- KEYS[1]  => task_key
+-- KEYS[2]  => task_waiter_key
+-- KEYS[3]  => result_key 前缀 (runner-node-result:{task_id})
+-- KEYS[4]  => 任务配额 key (runner-task-quota:{task_id})，可选
+-- KEYS[5]  => 默认配额 key (runner-task-quota)，可选
+-- ARGV[1]  => 提交方的 in-flight 预算，0 表示不限制
+-- ARGV[2:] => 以三元组的形式批量注册节点，每组依次为：
+--             exec_id, job (任务定义，字符串), dep (逗号分隔的依赖 exec_id 列表，字符串)
+-- 返回值   => 每个节点的 dep_cnt 列表，顺序与 ARGV 中的节点顺序一致；
+--             -1 表示任务已取消或依赖已失败，节点直接标记为 CANCELLED，不应发布；
+--             {'QUOTA', active, quota} 表示注册后未结束的节点数会超过配额，本次不注册任何节点
+-- 未结束（PENDING / RUNNING / WAITING_SERVICE）的节点数记录在 task_key 的 active 字段，
+-- 配额取提交方预算、任务配额、默认配额中大于 0 的最小值
 
 local task_key = KEYS[1]
 local task_waiter_key = KEYS[2]
-local exec_id  = ARGV[1]
-local job_def  = ARGV[2]
-local dep_str  = ARGV[3]
-
--- 1. 更新 job 和 dep 列表
-redis.call('HSET', task_key, 'job:' .. exec_id, job_def)
-redis.call('HSET', task_key, 'dep:' .. exec_id, dep_str)
---    初始化状态为 PENDING
-redis.call('HSET', task_key, 'state:' .. exec_id, 'PENDING')
-
--- 2. 统计处于 PENDING 或 RUNNING 的依赖
-local dep_cnt = 0
-if dep_str ~= '' then
-  for dep_id in string.gmatch(dep_str, '([^,]+)') do
-    local state = redis.call('HGET', task_key, 'state:' .. dep_id)
-    if state == 'PENDING' or state == 'RUNNING' then
-      redis.call('SADD', task_waiter_key .. ':' .. dep_id, exec_id)
-      dep_cnt = dep_cnt + 1
+local result_key = KEYS[3]
+local dep_cnt_list = {}
+local cancelled = redis.call('HGET', task_key, 'cancelled')
+
+local quota = 0
+local function limit(value)
+  value = tonumber(value) or 0
+  if value > 0 and (quota == 0 or value < quota) then
+    quota = value
+  end
+end
+limit(ARGV[1])
+if KEYS[4] then limit(redis.call('GET', KEYS[4])) end
+if KEYS[5] then limit(redis.call('GET', KEYS[5])) end
+
+local active = tonumber(redis.call('HGET', task_key, 'active')) or 0
+if quota > 0 and not cancelled and active + (#ARGV - 1) / 3 > quota then
+  return {'QUOTA', active, quota}
+end
+
+local registered = 0
+for i = 2, #ARGV, 3 do
+  local exec_id  = ARGV[i]
+  local job_def  = ARGV[i + 1]
+  local dep_str  = ARGV[i + 2]
+
+  -- 1. 更新 job 和 dep 列表
+  redis.call('HSET', task_key, 'job:' .. exec_id, job_def)
+  redis.call('HSET', task_key, 'dep:' .. exec_id, dep_str)
+  --    初始化状态为 PENDING
+  redis.call('HSET', task_key, 'state:' .. exec_id, 'PENDING')
+
+  -- 2. 统计尚未结束（PENDING / RUNNING / WAITING_SERVICE）的依赖；任务已取消或依赖已失败时记录原因
+  local dep_cnt = 0
+  local cancel_reason = cancelled
+  if dep_str ~= '' and not cancel_reason then
+    for dep_id in string.gmatch(dep_str, '([^,]+)') do
+      local state = redis.call('HGET', task_key, 'state:' .. dep_id)
+      if state == 'PENDING' or state == 'RUNNING' or state == 'WAITING_SERVICE' then
+        redis.call('SADD', task_waiter_key .. ':' .. dep_id, exec_id)
+        dep_cnt = dep_cnt + 1
+      elseif state == 'ERROR' or state == 'CANCELLED' then
+        cancel_reason = redis.call('LINDEX', result_key .. ':' .. dep_id, 0)
+        break
+      end
     end
   end
+
+  -- 3. 写回 dep_cnt
+  if cancel_reason then
+    redis.call('HSET', task_key, 'state:' .. exec_id, 'CANCELLED')
+    redis.call('LPUSH', result_key .. ':' .. exec_id, cancel_reason)
+    dep_cnt = -1
+  else
+    registered = registered + 1
+  end
+  redis.call('HSET', task_key, 'dep_cnt:' .. exec_id, dep_cnt)
+  dep_cnt_list[#dep_cnt_list + 1] = dep_cnt
 end
 
--- 3. 写回 dep_cnt 并返回
-redis.call('HSET', task_key, 'dep_cnt:' .. exec_id, dep_cnt)
-return dep_cnt
+redis.call('HINCRBY', task_key, 'active', registered)
+return dep_cnt_list
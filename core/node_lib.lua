@@ -0,0 +1,42 @@
+-- finish_task.lua 与 cancel_task.lua 共用的节点状态操作，由 Context._read_lua 在 "-- #include" 处展开
+-- 使用前需定义 task_key / task_waiter_key / result_key
+
+local function get_state(id)
+  return redis.call('HGET', task_key, 'state:' .. id)
+end
+
+local function is_active(id)
+  local state = get_state(id)
+  return state == 'PENDING' or state == 'RUNNING' or state == 'WAITING_SERVICE'
+end
+
+-- 只对未结束的节点调用，同时维护未结束节点数（见 init_task.lua）
+local function terminate(id, state, value)
+  redis.call('HSET', task_key, 'state:' .. id, state)
+  redis.call('HINCRBY', task_key, 'active', -1)
+  redis.call('LPUSH', result_key .. ':' .. id, value)
+end
+
+-- 失败或取消：queue 中节点的所有下游节点、等待它们的外层节点（finish_pointer）依次标记为 CANCELLED，不再发布
+-- 返回本次标记的节点数
+local function cancel_downstream(queue, value)
+  local cnt = 0
+  local head = 1
+  while head <= #queue do
+    local id = queue[head]
+    head = head + 1
+    local downstream = redis.call('SMEMBERS', task_waiter_key .. ':' .. id)
+    local outer_id = redis.call('HGET', task_key, 'finish_pointer:' .. id)
+    if outer_id then
+      downstream[#downstream + 1] = outer_id
+    end
+    for _, cid in ipairs(downstream) do
+      if is_active(cid) then
+        terminate(cid, 'CANCELLED', value)
+        queue[#queue + 1] = cid
+        cnt = cnt + 1
+      end
+    end
+  end
+  return cnt
+end
@@ -0,0 +1,15 @@
+-- KEYS[1]  => task_key
+-- ARGV[1]  => exec_id
+-- 返回值   => 1 节点由 RUNNING 转为 WAITING_SERVICE，结果将由 Service 通过 finish_task 写入；
+--             0 节点已经结束（例如任务被取消），不应再派发请求
+
+local task_key = KEYS[1]
+local exec_id = ARGV[1]
+
+if redis.call('HGET', task_key, 'state:' .. exec_id) ~= 'RUNNING' then
+  return 0
+end
+redis.call('HSET', task_key, 'state:' .. exec_id, 'WAITING_SERVICE')
+-- 不再有 Runner 持有该节点，清除租约
+redis.call('HDEL', task_key, 'owner:' .. exec_id, 'lease:' .. exec_id)
+return 1
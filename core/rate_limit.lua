@@ -0,0 +1,51 @@
+-- KEYS[1]  => 请求数令牌桶 (rate-limit:{provider}:{model}:rpm)
+-- KEYS[2]  => token 数令牌桶 (rate-limit:{provider}:{model}:tpm)
+-- ARGV[1]  => 每分钟请求数上限，0 表示不限制
+-- ARGV[2]  => 每分钟 token 数上限，0 表示不限制
+-- ARGV[3]  => 本次请求预计消耗的 token 数
+-- 返回值   => 0 表示已获取（两个桶同时扣减）；否则为还需等待的毫秒数，此时不扣减任何桶
+-- 令牌桶容量为每分钟上限，按 上限 / 60 秒 的速率连续补充；时间取 Redis 服务器时间，多台机器共享同一时钟
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local function refill(key, limit)
+  local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(bucket[1]) or limit
+  local ts = tonumber(bucket[2]) or now
+  return math.min(limit, tokens + math.max(now - ts, 0) * limit / 60000)
+end
+
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local need = math.min(tonumber(ARGV[3]), tpm)
+local wait = 0
+local requests, tokens
+
+if rpm > 0 then
+  requests = refill(KEYS[1], rpm)
+  if requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60000 / rpm)
+  end
+end
+if tpm > 0 then
+  tokens = refill(KEYS[2], tpm)
+  if tokens < need then
+    wait = math.max(wait, (need - tokens) * 60000 / tpm)
+  end
+end
+
+if wait > 0 then
+  return math.ceil(wait)
+end
+
+-- 桶在空闲两分钟后必然已补满，过期删除即可
+if rpm > 0 then
+  redis.call('HSET', KEYS[1], 'tokens', tostring(requests - 1), 'ts', now)
+  redis.call('PEXPIRE', KEYS[1], 120000)
+end
+if tpm > 0 then
+  redis.call('HSET', KEYS[2], 'tokens', tostring(tokens - need), 'ts', now)
+  redis.call('PEXPIRE', KEYS[2], 120000)
+end
+return 0
@@ -0,0 +1,32 @@
+-- KEYS[1]  => replica_set_key (service-replicas:{service_id})
+-- ARGV[1]  => replica_key 前缀 (service-replica:{service_id})
+-- 返回值   => 负载（in_flight / capacity）最低的存活副本的请求队列名，并为其预占一个 in_flight；
+--             没有存活副本时返回 false
+-- 心跳过期的副本（hash 已不存在）顺便从集合中移除
+
+local replica_set_key = KEYS[1]
+local replica_prefix = ARGV[1]
+local best_key, best_queue, best_load
+
+for _, replica_id in ipairs(redis.call('SMEMBERS', replica_set_key)) do
+  local replica_key = replica_prefix .. ':' .. replica_id
+  local fields = redis.call('HMGET', replica_key, 'queue', 'capacity', 'in_flight')
+  if not fields[1] then
+    redis.call('SREM', replica_set_key, replica_id)
+  else
+    local capacity = tonumber(fields[2]) or 1
+    if capacity < 1 then capacity = 1 end
+    local load = (tonumber(fields[3]) or 0) / capacity
+    if not best_load or load < best_load then
+      best_key, best_queue, best_load = replica_key, fields[1], load
+    end
+  end
+end
+
+if not best_key then
+  return false
+end
+-- 心跳之间调用方看到的负载不会变化，预占一个名额以免所有请求都涌向同一个副本；
+-- 副本的下一次心跳会用真实值覆盖
+redis.call('HINCRBY', best_key, 'in_flight', 1)
+return best_queue
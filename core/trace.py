@@ -0,0 +1,200 @@
+"""
+节点耗时账本与关键路径分析。
+
+每个节点在以下时刻打点（毫秒时间戳），写入任务级别的 Redis stream：
+    submitted  Computable 提交节点
+    ready      依赖全部满足、发布到 RabbitMQ
+    dequeued   Runner 收到消息
+    resolved   依赖结果读取完成
+    start/end  compute 开始 / 结束
+    stored     结果写入、子任务调度完成
+
+redis data structure:
+    stream: runner-node-trace:{task_id}  每条记录包含 id (exec_id) 以及若干 事件名 -> 时间戳
+
+用法：
+    python -m core.trace <task_id> [--top N]
+"""
+import time
+
+from core.Utils import deserialize
+
+#: 单个任务最多保留的打点记录数（近似裁剪）
+TRACE_MAXLEN = 200000
+
+
+def trace_key(task_id):
+    return f"runner-node-trace:{task_id}"
+
+
+def now_ms():
+    return time.time() * 1000
+
+
+def record(redis, task_id, exec_id, **events):
+    """记录一个节点的若干事件；redis 可以是 pipeline，以便与其他命令合并发送。"""
+    fields = {"id": exec_id}
+    fields.update({name: f"{ts:.3f}" for name, ts in events.items()})
+    redis.xadd(trace_key(task_id), fields, maxlen=TRACE_MAXLEN, approximate=True)
+
+
+def load(redis, task_id):
+    """
+    读取任务的打点与 DAG，返回 {exec_id: node}，node 包含 task、deps、inner 以及各事件时间戳。
+    """
+    task_key = f"runner-node:{task_id}"
+    nodes = {}
+
+    def node(exec_id):
+        return nodes.setdefault(
+            int(exec_id), {"task": "?", "deps": [], "inner": None, "outer": None, "state": None}
+        )
+
+    for field, value in redis.hscan_iter(task_key):
+        kind, _, exec_id = field.partition(":")
+        if not exec_id:
+            continue
+        if kind == "dep":
+            node(exec_id)["deps"] = [int(d) for d in value.split(",") if d]
+        elif kind == "job":
+            node(exec_id)["task"] = deserialize(value)["task"]
+        elif kind == "state":
+            node(exec_id)["state"] = value
+        elif kind == "finish_pointer":
+            # exec_id 完成时 value 才算完成
+            node(value)["inner"] = int(exec_id)
+            node(exec_id)["outer"] = int(value)
+
+    for _, fields in redis.xrange(trace_key(task_id)):
+        n = node(fields.pop("id"))
+        for name, ts in fields.items():
+            # 对冲或重复执行会有多条记录，保留最早完成的一次
+            n[name] = min(float(ts), n.get(name, float("inf")))
+
+    return nodes
+
+
+def finished_at(nodes, exec_id, _seen=None):
+    """节点真正完成的时间：委托给内层节点的外层节点以内层完成时间为准。"""
+    n = nodes[exec_id]
+    if n["inner"] is not None and n["inner"] in nodes:
+        _seen = _seen or set()
+        if exec_id not in _seen:
+            _seen.add(exec_id)
+            return finished_at(nodes, n["inner"], _seen)
+    return n.get("stored", n.get("end"))
+
+
+def predecessors(nodes, exec_id):
+    """
+    委托给内层节点的外层节点只等待内层节点；内层节点由外层节点在依赖满足后提交，
+    因此除自身依赖外，还继承外层节点的依赖。
+    """
+    n = nodes[exec_id]
+    if n["inner"] is not None and n["inner"] in nodes:
+        return [n["inner"]]
+    preds = list(n["deps"])
+    if n["outer"] is not None and n["outer"] in nodes:
+        preds.extend(nodes[n["outer"]]["deps"])
+    return preds
+
+
+def critical_path(nodes):
+    """
+    从最晚完成的节点出发，每一步回溯到最晚完成的前驱，返回从起点到终点的 exec_id 列表。
+    """
+    done = {eid: finished_at(nodes, eid) for eid in nodes}
+    done = {eid: ts for eid, ts in done.items() if ts is not None}
+    if not done:
+        return []
+    path = [max(done, key=done.get)]
+    seen = set(path)
+    while True:
+        preds = [p for p in predecessors(nodes, path[-1]) if p in done and p not in seen]
+        if not preds:
+            break
+        prev = max(preds, key=done.get)
+        path.append(prev)
+        seen.add(prev)
+    return list(reversed(path))
+
+
+def phases(n):
+    """返回节点各阶段耗时（毫秒），缺失的打点记为 None。"""
+    def span(a, b):
+        return n[b] - n[a] if a in n and b in n else None
+
+    return {
+        "wait_deps": span("submitted", "ready"),
+        "queue": span("ready", "dequeued"),
+        "resolve": span("dequeued", "resolved"),
+        "compute": span("start", "end"),
+        "store": span("end", "stored"),
+    }
+
+
+def _fmt(ms):
+    return "-" if ms is None else f"{ms:10.1f}"
+
+
+def report(nodes, top=10):
+    lines = []
+    starts = [n["submitted"] for n in nodes.values() if "submitted" in n]
+    ends = [ts for ts in (finished_at(nodes, eid) for eid in nodes) if ts is not None]
+    wall = max(ends) - min(starts) if starts and ends else None
+    lines.append(f"nodes: {len(nodes)}    wall time: {_fmt(wall).strip()} ms")
+
+    totals = {"wait_deps": 0.0, "queue": 0.0, "resolve": 0.0, "compute": 0.0, "store": 0.0}
+    for n in nodes.values():
+        for k, v in phases(n).items():
+            if v is not None:
+                totals[k] += v
+    lines.append("")
+    lines.append("time breakdown (sum over nodes, ms):")
+    for k, v in totals.items():
+        lines.append(f"  {k:<10}{v:12.1f}")
+
+    lines.append("")
+    lines.append("critical path:")
+    header = f"  {'exec_id':>8}  {'operator':<36}{'queue':>10} {'resolve':>10} {'compute':>10} {'store':>10}"
+    lines.append(header)
+    for eid in critical_path(nodes):
+        n = nodes[eid]
+        p = phases(n)
+        lines.append(
+            f"  {eid:>8}  {n['task'][-36:]:<36}"
+            f"{_fmt(p['queue'])} {_fmt(p['resolve'])} {_fmt(p['compute'])} {_fmt(p['store'])}"
+        )
+
+    per_op = {}
+    for n in nodes.values():
+        c = phases(n)["compute"]
+        if c is None:
+            continue
+        stat = per_op.setdefault(n["task"], {"count": 0, "total": 0.0, "max": 0.0})
+        stat["count"] += 1
+        stat["total"] += c
+        stat["max"] = max(stat["max"], c)
+    lines.append("")
+    lines.append(f"slowest operators (top {top} by total compute, ms):")
+    lines.append(f"  {'operator':<44}{'count':>7}{'total':>12}{'mean':>10}{'max':>10}")
+    for task, stat in sorted(per_op.items(), key=lambda kv: kv[1]["total"], reverse=True)[:top]:
+        lines.append(
+            f"  {task[-44:]:<44}{stat['count']:>7}{stat['total']:12.1f}"
+            f"{stat['total'] / stat['count']:10.1f}{stat['max']:10.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from core.Context import Context
+
+    parser = argparse.ArgumentParser(description="Print the critical path and timing breakdown of a task")
+    parser.add_argument("task_id")
+    parser.add_argument("--top", type=int, default=10, help="Number of operators to list")
+    args = parser.parse_args()
+
+    with Context(task_id=args.task_id) as ctx:
+        print(report(load(ctx.redis, args.task_id), top=args.top))
@@ -2,6 +2,7 @@ import sys
 import os
 import uuid
 import json
+import tempfile
 from paddleocr import PaddleOCR
 import os
 
@@ -17,6 +18,10 @@ class OCRService(Service):
     参考：https://paddlepaddle.github.io/PaddleOCR/main/version3.x/pipeline_usage/OCR.html#22-python
     """
 
+    #: 一次最多合并 8 张图片推理，GPU 上吞吐明显高于逐张处理
+    batch_size = 8
+    batch_wait_ms = 20
+
     def __init__(self):
         config_path = os.path.join(os.path.dirname(__file__), "config.json")
         config = json.loads(open(config_path).read())
@@ -36,9 +41,11 @@ class OCRService(Service):
         result = minio_client.compute("read", bucket, object_name)
         if not result:
             raise FileNotFoundError(f"File not found in Minio: {bucket}/{object_name}")
-        file_path = os.path.join("./tmp", object_name)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "wb") as f:
+        # 每个请求使用独立的临时文件：同一批中可能有同名对象（或不同桶的同名对象），
+        # 共用路径会互相覆盖，先完成的请求删除文件后其他请求找不到文件
+        os.makedirs("./tmp", exist_ok=True)
+        fd, file_path = tempfile.mkstemp(suffix=os.path.splitext(object_name)[1], dir="./tmp")
+        with os.fdopen(fd, "wb") as f:
             f.write(result)
         return file_path
     
@@ -80,6 +87,33 @@ class OCRService(Service):
             self.rm_file(file_path)
         return result
 
+    def compute_batch(self, requests):
+        """
+        批量 OCR：先逐个下载文件，再一次性交给 PaddleOCR 推理，按文件把结果分组返回。
+        下载失败的请求只在对应位置返回异常，不影响同批的其他请求。
+        :param requests: [(args, kwargs), ...]，参数同 compute
+        :return: 与 requests 等长的结果列表
+        """
+        results = [None] * len(requests)
+        paths = {}
+        for i, (args, kwargs) in enumerate(requests):
+            try:
+                paths[i] = self.download_file(*args, **kwargs)
+            except Exception as e:
+                results[i] = e
+        try:
+            if paths:
+                grouped = {path: [] for path in paths.values()}
+                for res in self.ocr.predict(list(paths.values())):
+                    res = res._to_json()
+                    grouped[res["res"]["input_path"]].append(res)
+                for i, path in paths.items():
+                    results[i] = grouped[path]
+        finally:
+            for path in paths.values():
+                self.rm_file(path)
+        return results
+
 
 # 示例调用
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+"""
+离线测试用的 OpenAI 兼容 Chat Completions 桩服务，可以模拟延迟、5xx 错误与超时。
+
+    python test/stub_llm_server.py --port 8001 --latency 0.2 --error-rate 0.3
+
+在测试脚本中也可以直接启动：start(port=0, latency=0.05) 返回服务对象，server.server_port 为实际端口。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server.requests += 1
+        server.last_body = body
+        time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            self._reply(500, {"error": {"message": "stub internal error", "type": "server_error"}})
+            return
+        prompt = body["messages"][-1]["content"]
+        reply = json.dumps({
+            "id": f"stub-{server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": f"[{server.name}] {prompt}"},
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+        self._reply(200, json.loads(reply))
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start(port=0, latency=0.05, error_rate=0.0, name="stub"):
+    """在后台线程中启动桩服务。latency / error_rate 可以在运行中修改。"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.name = name
+    server.requests = 0
+    server.last_body = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds to wait before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--name", default="stub")
+    args = parser.parse_args()
+    stub = start(args.port, args.latency, args.error_rate, args.name)
+    print(f"Stub LLM server listening on http://127.0.0.1:{stub.server_port}/v1")
+    threading.Event().wait()
@@ -5,7 +5,6 @@ import uuid
 from coper.LLM import LLM
 import time
 from pydantic import BaseModel, Field
-from coper.Minio import Minio
 
 
 class CodeAnswer(BaseModel):
@@ -25,15 +24,15 @@ if __name__ == "__main__":
         # llm_language = LLM("Qwen3-32B", "VLLM")
         # llm_language = LLM("DeepSeek-R1", "SDU")
 
-        # 视觉大模型测试
+        # 视觉大模型测试：只传递 MinIO 对象引用，图片在 Worker 中读取
         prompt = "回答这个图片，说明这个图片做了什么？请用中文回答。"
-        image_base64 = Minio()(
-            function_name="read",
-            bucket="test-bucket",
-            object_name="PixPin_2025-06-10_16-05-14.jpg",
-            output_format="base64"
-        )
-        response1 = llm(prompt, image_base64).result()
+        image = {"bucket": "test-bucket", "object_name": "PixPin_2025-06-10_16-05-14.jpg"}
+        response1 = llm(prompt, image).result()
+        print(f"Prompt: {prompt}\ntype: {type(response1)}\nResponse:\n{response1}")
+        print('='*50)
+
+        # 预签名 URL 模式：模型端点直接从 MinIO 下载图片（要求端点能访问 MinIO）
+        response1 = llm(prompt, {**image, "mode": "url"}).result()
         print(f"Prompt: {prompt}\ntype: {type(response1)}\nResponse:\n{response1}")
         print('='*50)
 
@@ -0,0 +1,27 @@
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stub_llm_server import start
+
+
+if __name__ == "__main__":
+    from core.Context import Context
+    from coper.LLM import LLM
+
+    # 三个本地桩端点：快但经常 500、慢、正常
+    flaky = start(latency=0.02, error_rate=0.8, name="flaky")
+    slow = start(latency=0.5, name="slow")
+    good = start(latency=0.05, name="good")
+    for name, stub in (("FLAKY", flaky), ("SLOW", slow), ("GOOD", good)):
+        os.environ[f"{name}_API_KEY"] = "stub"
+        os.environ[f"{name}_BASE_URL"] = f"http://127.0.0.1:{stub.server_port}/v1"
+
+    with Context(task_id=str(uuid.uuid4().hex)) as ctx:
+        llm = LLM("stub-model", routes=["FLAKY:stub-model", "SLOW:stub-model", "GOOD:stub-model"])
+        for i in range(30):
+            print(llm.compute(f"question {i}")["content"])
+        print(llm.router.stats())
+        print(f"requests: flaky={flaky.requests} slow={slow.requests} good={good.requests}")
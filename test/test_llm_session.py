@@ -0,0 +1,30 @@
+import json
+import os
+import sys
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stub_llm_server import start
+
+
+if __name__ == "__main__":
+    from core.Context import Context
+    from coper.LLMSession import LLMSession
+
+    stub = start(latency=0.02, name="stub")
+    os.environ["STUB_API_KEY"] = "stub"
+    os.environ["STUB_BASE_URL"] = f"http://127.0.0.1:{stub.server_port}/v1"
+
+    with Context(task_id=str(uuid.uuid4().hex)) as ctx:
+        for policy in ("trim", "summarize"):
+            session = LLMSession("stub-model", "STUB", policy=policy, max_tokens=200, keep_recent=4)
+            previous = None
+            for i in range(10):
+                # 每轮只提交本轮 prompt，after 保证轮次依次执行
+                previous = session(f"turn {i}: " + "tell me more " * 10, after=previous)
+                print(previous.result()["content"][:40],
+                      f"payload={len(json.dumps(stub.last_body['messages']))}")
+            history = session.history()
+            print(policy, history["turns"], len(history["messages"]), history["summary"])
+            session.clear()
@@ -0,0 +1,25 @@
+import uuid
+
+if __name__ == "__main__":
+    from core.Context import Context
+    from core.Computable import Computable
+    from core.ComputableResult import gather
+    from coper.basic_ops import Add, Mul, Sum
+
+    with Context(task_id=str(uuid.uuid4())):
+        mul = Mul()
+        add = Add()
+
+        # 批量提交 100 个节点：一次 INCRBY、一次脚本调用、一次批量发布
+        squares = mul.map(range(100), y=2)
+        print(f"{squares[:3]} ...")
+
+        # 结果列表可以直接作为其他算子的参数
+        total = add(squares[0], squares[-1])
+        print(f"{total.result()}")
+
+        print(f"{gather(squares)[:10]}")
+
+        # 平衡 8 叉树聚合，任意节点最多 8 个依赖
+        tree_total = Computable.reduce(squares, Sum(), arity=8)
+        print(f"{tree_total.result()}")
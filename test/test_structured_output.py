@@ -0,0 +1,65 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field, ValidationError
+
+from coper.LLM import restore_model_from_schema
+
+
+class Step(BaseModel):
+    reasoning: str = Field(description="Think first")
+    answer: str
+
+
+class Address(BaseModel):
+    city: str
+    zip: Optional[str] = None
+
+
+class Person(BaseModel):
+    name: str
+    role: Literal["admin", "user"]
+    addresses: list[Address]
+    tags: dict[str, int] = {}
+
+
+class Node(BaseModel):
+    value: int
+    children: list["Node"] = []
+
+
+if __name__ == "__main__":
+    # 字段顺序与 schema 一致（结构化解码按该顺序生成）
+    model = restore_model_from_schema(Step.model_json_schema())
+    assert list(model.model_fields) == ["reasoning", "answer"]
+    assert list(model.model_json_schema()["properties"]) == ["reasoning", "answer"]
+
+    # 相同 schema 命中编译缓存；属性顺序不同的 schema 编译为不同的模型
+    assert restore_model_from_schema(Step.model_json_schema()) is model
+    reordered = Step.model_json_schema()
+    reordered["properties"] = dict(reversed(list(reordered["properties"].items())))
+    assert list(restore_model_from_schema(reordered).model_fields) == ["answer", "reasoning"]
+
+    # 嵌套 object、$defs 引用、enum 与 additionalProperties
+    model = restore_model_from_schema(Person.model_json_schema())
+    data = {"name": "a", "role": "admin", "addresses": [{"city": "Jinan"}], "tags": {"x": 1}}
+    assert model.model_validate(data).model_dump() == {**data, "addresses": [{"city": "Jinan", "zip": None}]}
+    for bad in ({**data, "role": "root"}, {**data, "addresses": [{"zip": "250000"}]}, {**data, "tags": {"x": "y"}}):
+        try:
+            model.model_validate(bad)
+        except ValidationError:
+            pass
+        else:
+            raise AssertionError(f"{bad} should not validate")
+
+    # 递归 $ref
+    model = restore_model_from_schema(Node.model_json_schema())
+    tree = {"value": 1, "children": [{"value": 2, "children": [{"value": 3, "children": []}]}]}
+    assert model.model_validate(tree).model_dump() == tree
+    try:
+        model.model_validate({"value": 1, "children": [{"value": "x", "children": []}]})
+    except ValidationError:
+        pass
+    else:
+        raise AssertionError("nested value should be validated")
+
+    print("structured output schema tests passed")